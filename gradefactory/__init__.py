@@ -9,6 +9,7 @@ from .job_manager import (
     JobRecord,
     StageSnapshot,
 )
+from .job_store import JobStore
 from .pipeline import GradeFactoryPipeline, JobPaths, PipelineResult, StageResult
 
 __all__ = [
@@ -18,6 +19,7 @@ __all__ = [
     "StageResult",
     "JobManager",
     "JobRecord",
+    "JobStore",
     "StageSnapshot",
     "JOB_STATUS_PENDING",
     "JOB_STATUS_RUNNING",
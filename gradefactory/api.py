@@ -1,21 +1,37 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import os
 from pathlib import Path
 
 from typing import List, Optional
 
-from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+import aiofiles
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
-from .job_manager import JobManager
+from .job_manager import (
+    JOB_STATUS_COMPLETED,
+    JOB_STATUS_FAILED,
+    MAX_BATCH_BYTES,
+    MAX_PDF_BYTES,
+    JobManager,
+    JobRecord,
+    UploadBudget,
+    UploadTooLarge,
+)
+from .storage import InvalidUploadToken, LocalSignedStore
+from .utils import unique_filename
 
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / 'static'
+# Idle SSE connections get a comment line this often so proxies keep them open.
+SSE_KEEPALIVE_SECONDS = 15
 
 app = FastAPI(title="GradeFactory Web API", version="0.1.0")
 app.mount('/static', StaticFiles(directory=STATIC_DIR), name='static')
@@ -31,8 +47,71 @@ app.add_middleware(
 
 load_dotenv()
 
+
+class UploadLimitMiddleware:
+    """
+    Rejects upload requests whose body is larger than the matching limit with 413.
+    Requests with a Content-Length are refused before any byte is read; chunked bodies are
+    counted as they arrive, since Starlette spools a whole multipart form to disk before
+    the endpoint (and its own per-file checks) ever runs.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        limit = self._limit_for(scope)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length", b"").decode("latin-1")
+        if content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds the limit of {limit} bytes.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    def _limit_for(scope) -> Optional[int]:
+        if scope["type"] != "http":
+            return None
+        if scope["method"] == "POST" and scope["path"].startswith("/jobs/"):
+            return MAX_BATCH_BYTES
+        if scope["method"] == "PUT" and scope["path"].startswith("/uploads/"):
+            return MAX_PDF_BYTES
+        return None
+
+    @staticmethod
+    async def _reject(send, limit: int) -> None:
+        response = JSONResponse(status_code=413, content={"detail": f"Upload exceeds the limit of {limit} bytes."})
+        await send({"type": "http.response.start", "status": 413, "headers": response.raw_headers})
+        await send({"type": "http.response.body", "body": response.body})
+
+
+app.add_middleware(UploadLimitMiddleware)
+
 PIN_CODE = os.getenv("GRADEFACTORY_PIN")
 
+_upload_secret = os.getenv("GF_UPLOAD_SECRET")
+upload_store = LocalSignedStore(
+    manager.pipeline.jobs_root / "_uploads",
+    secret=_upload_secret.encode("utf-8") if _upload_secret else None,
+    ttl_seconds=int(os.getenv("GF_UPLOAD_TTL", "900")),
+)
+
 
 def require_pin(x_gradefactory_pin: Optional[str] = Header(default=None)) -> None:
     if not PIN_CODE:
@@ -47,6 +126,57 @@ def _require_pdfs(files: List[UploadFile]) -> None:
             raise HTTPException(status_code=400, detail="Only PDF files are supported for this endpoint.")
 
 
+def _require_pdf_keys(keys: List[str]) -> None:
+    if len(set(keys)) != len(keys):
+        raise HTTPException(status_code=400, detail="Each upload key may only be submitted once.")
+    for key in keys:
+        try:
+            staged = upload_store.staged_path(key)
+        except InvalidUploadToken as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from None
+        if not staged.name.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail="Only PDF files are supported for this endpoint.")
+        if not staged.is_file():
+            raise HTTPException(status_code=400, detail=f"No completed upload for key: {key}")
+
+
+def _adopt_uploads(keys: List[str], destination: Path, budget: UploadBudget, taken: set) -> None:
+    try:
+        # Staged files count against the request's batch limit like streamed ones;
+        # check them all before moving any.
+        staged = [upload_store.staged_path(key) for key in keys]
+        for path in staged:
+            budget.consume(path.stat().st_size)
+        for key, path in zip(keys, staged):
+            upload_store.take(key, destination, unique_filename(path.name, taken))
+    except (InvalidUploadToken, FileNotFoundError) as exc:
+        # Another request claimed the key between validation and adoption.
+        raise HTTPException(status_code=409, detail=str(exc)) from None
+
+
+async def _receive_job_files(
+    job: JobRecord,
+    uploads: List[UploadFile],
+    keys: List[str],
+    destination: Path,
+    rubric: Optional[UploadFile] = None,
+) -> Optional[Path]:
+    budget = UploadBudget()
+    taken: set = set()
+    try:
+        await manager.stream_uploads(job, uploads, destination, budget=budget, taken=taken)
+        rubric_path = await manager.stream_rubric(job, rubric, budget=budget) if rubric else None
+        _adopt_uploads(keys, destination, budget, taken)
+    except UploadTooLarge as exc:
+        manager.discard_job(job.job_id)
+        raise HTTPException(status_code=413, detail=str(exc)) from None
+    except BaseException:
+        # Any other failure (e.g. a full disk) must not leave a pending job behind.
+        manager.discard_job(job.job_id)
+        raise
+    return rubric_path
+
+
 def _require_rubric(upload: UploadFile) -> None:
     if not upload.filename:
         raise HTTPException(status_code=400, detail="A rubric file is required.")
@@ -71,12 +201,7 @@ def healthcheck() -> dict:
 
 @app.get("/jobs")
 def list_jobs(_: None = Depends(require_pin)) -> List[dict]:
-    snapshots: List[dict] = []
-    for record in manager.list_jobs():
-        snapshot = manager.snapshot(record.job_id)
-        if snapshot:
-            snapshots.append(snapshot)
-    return snapshots
+    return manager.list_snapshots()
 
 
 @app.get("/jobs/{job_id}")
@@ -87,6 +212,33 @@ def get_job(job_id: str, _: None = Depends(require_pin)) -> dict:
     return snapshot
 
 
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, _: None = Depends(require_pin)) -> StreamingResponse:
+    queue = manager.watch(job_id)
+    if queue is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        try:
+            while True:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(snapshot)}\n\n"
+                if snapshot["status"] in {JOB_STATUS_COMPLETED, JOB_STATUS_FAILED}:
+                    break
+        finally:
+            manager.unwatch(job_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.delete("/jobs/{job_id}")
 def delete_job(job_id: str, _: None = Depends(require_pin)) -> dict:
     try:
@@ -98,19 +250,68 @@ def delete_job(job_id: str, _: None = Depends(require_pin)) -> dict:
     return {"status": "deleted", "id": job_id}
 
 
+@app.post("/uploads/presign")
+def presign_uploads(
+    filenames: List[str] = Form(..., description="Names of the PDFs the client is about to upload"),
+    _: None = Depends(require_pin),
+) -> List[dict]:
+    slots: List[dict] = []
+    for filename in filenames:
+        if not filename.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail="Only PDF files are supported for this endpoint.")
+        key, token, expires_at = upload_store.presign(filename)
+        slots.append({"key": key, "url": f"/uploads/{token}", "expires_at": expires_at})
+    return slots
+
+
+@app.put("/uploads/{token}")
+async def receive_upload(token: str, request: Request) -> dict:
+    try:
+        target = upload_store.staged_path(upload_store.verify(token))
+    except InvalidUploadToken as exc:
+        raise HTTPException(status_code=403, detail=str(exc)) from None
+
+    if target.exists():
+        raise HTTPException(status_code=409, detail="Upload URL has already been used.")
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(f"{target.name}.part")
+    try:
+        # Exclusive create makes each signed URL single-use while the body streams in.
+        async with aiofiles.open(partial, "xb") as handle:
+            written = 0
+            async for chunk in request.stream():
+                written += len(chunk)
+                if written > MAX_PDF_BYTES:
+                    raise UploadTooLarge(f"Upload exceeds the per-file limit of {MAX_PDF_BYTES} bytes.")
+                await handle.write(chunk)
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail="Upload URL has already been used.") from None
+    except UploadTooLarge as exc:
+        partial.unlink(missing_ok=True)
+        raise HTTPException(status_code=413, detail=str(exc)) from None
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    os.replace(partial, target)
+    return {"key": f"{target.parent.name}/{target.name}"}
+
+
 @app.post("/jobs/process")
 async def create_processing_job(
-    raw_files: List[UploadFile] = File(..., description="Raw PDF essays to process"),
+    raw_files: Optional[List[UploadFile]] = File(None, description="Raw PDF essays to process"),
+    raw_file_keys: Optional[List[str]] = Form(None, description="Keys of PDFs already sent to /uploads"),
     name_flag: bool = Form(True),
     _: None = Depends(require_pin),
 ) -> dict:
-    if not raw_files:
+    raw_files = raw_files or []
+    raw_file_keys = raw_file_keys or []
+    if not raw_files and not raw_file_keys:
         raise HTTPException(status_code=400, detail="At least one PDF must be uploaded.")
     _require_pdfs(raw_files)
+    _require_pdf_keys(raw_file_keys)
 
     job = manager.create_job("process")
-    file_payload = [(upload.filename, await upload.read()) for upload in raw_files]
-    manager.write_files(job, file_payload, job.paths.raw_input)
+    await _receive_job_files(job, raw_files, raw_file_keys, job.paths.raw_input)
     manager.start_processing_job(job.job_id, name_flag=name_flag)
 
     for upload in raw_files:
@@ -124,21 +325,21 @@ async def create_processing_job(
 
 @app.post("/jobs/grade")
 async def create_grading_job(
-    processed_files: List[UploadFile] = File(..., description="Processed PDF essays ready for grading"),
     rubric: UploadFile = File(..., description="Rubric file (PDF or JSON)"),
+    processed_files: Optional[List[UploadFile]] = File(None, description="Processed PDF essays ready for grading"),
+    processed_file_keys: Optional[List[str]] = Form(None, description="Keys of PDFs already sent to /uploads"),
     _: None = Depends(require_pin),
 ) -> dict:
-    if not processed_files:
+    processed_files = processed_files or []
+    processed_file_keys = processed_file_keys or []
+    if not processed_files and not processed_file_keys:
         raise HTTPException(status_code=400, detail="At least one processed PDF must be uploaded.")
     _require_pdfs(processed_files)
+    _require_pdf_keys(processed_file_keys)
     _require_rubric(rubric)
 
     job = manager.create_job("grade")
-    file_payload = [(upload.filename, await upload.read()) for upload in processed_files]
-    manager.write_files(job, file_payload, job.paths.processed)
-
-    rubric_bytes = await rubric.read()
-    rubric_path = manager.write_rubric(job, rubric.filename, rubric_bytes)
+    rubric_path = await _receive_job_files(job, processed_files, processed_file_keys, job.paths.processed, rubric)
     manager.start_grading_job(job.job_id, rubric_path=rubric_path)
 
     for upload in processed_files:
@@ -153,22 +354,22 @@ async def create_grading_job(
 
 @app.post("/jobs/full")
 async def create_full_pipeline_job(
-    raw_files: List[UploadFile] = File(..., description="Raw PDF essays to process and grade"),
     rubric: UploadFile = File(..., description="Rubric file (PDF or JSON)"),
+    raw_files: Optional[List[UploadFile]] = File(None, description="Raw PDF essays to process and grade"),
+    raw_file_keys: Optional[List[str]] = Form(None, description="Keys of PDFs already sent to /uploads"),
     name_flag: bool = Form(True),
     _: None = Depends(require_pin),
 ) -> dict:
-    if not raw_files:
+    raw_files = raw_files or []
+    raw_file_keys = raw_file_keys or []
+    if not raw_files and not raw_file_keys:
         raise HTTPException(status_code=400, detail="At least one PDF must be uploaded.")
     _require_pdfs(raw_files)
+    _require_pdf_keys(raw_file_keys)
     _require_rubric(rubric)
 
     job = manager.create_job("full")
-    file_payload = [(upload.filename, await upload.read()) for upload in raw_files]
-    manager.write_files(job, file_payload, job.paths.raw_input)
-
-    rubric_bytes = await rubric.read()
-    rubric_path = manager.write_rubric(job, rubric.filename, rubric_bytes)
+    rubric_path = await _receive_job_files(job, raw_files, raw_file_keys, job.paths.raw_input, rubric)
     manager.start_full_pipeline(job.job_id, rubric_path=rubric_path, name_flag=name_flag)
 
     for upload in raw_files:
@@ -2,61 +2,92 @@ import os
 import sys
 import csv
 import re
-import concurrent.futures
+import asyncio
 from collections import OrderedDict
-import requests
 
 from .prompts import GRADING_PROMPT, MODERATOR_PROMPT
-from .utils import get_rubric_data, extract_text_from_pdf, save_to_pdf
+from .utils import (
+    RUBRIC_CACHE,
+    RUBRIC_CACHE_SIZE,
+    TEXT_CACHE,
+    TEXT_CACHE_SIZE,
+    cached_extract_text,
+    cached_rubric_data,
+    file_digest,
+    list_pdfs,
+    save_to_pdf,
+    trim_cache,
+)
+from .xai import chat_completion, make_client
 
-def get_evaluation(api_key, prompt, temperature, rubric_text, question, correct_answers, paper_text):
+GRADE_CONCURRENCY = int(os.getenv("GF_GRADE_CONCURRENCY", "8"))
+
+_CALIBRATION_PREFIX = "Calibrate evaluations for community college freshmen: Be fair, constructive, and motivational. Typical papers should score 10-15/20, not failing unless severely deficient.\n\n"
+_MODERATOR_PREFIX = f"{_CALIBRATION_PREFIX}{MODERATOR_PROMPT}\n\n"
+
+# One sweep finds both per-criterion lines and the total line; a total label that is
+# not followed by ':' (e.g. 'Totality:') backtracks into the criterion branch.
+_SCORE_RE = re.compile(
+    r'^\s*(?:(?P<total_label>Total|Overall(?:\s+Score)?|Final\s+Score)\s*|(?P<crit>[^:\n]+)):'
+    r'\s*(?P<earned>\d+(?:\.\d+)?)\s*/\s*(?P<maximum>\d+(?:\.\d+)?)\b',
+    re.IGNORECASE | re.MULTILINE,
+)
+
+def _make_client():
+    """
+    Builds the HTTP/2 client shared by every request in a grading batch.
+    The pool leaves room for three connections per in-flight paper.
+    """
+    return make_client(max(64, GRADE_CONCURRENCY * 3))
+
+def prepare_prompt_data(rubric_data):
+    """
+    Pre-formats the rubric sections shared by every request in a batch.
+    Returns a dict with 'rubric', 'question_block', 'answers_block'.
+    """
+    question = rubric_data['question']
+    correct_answers = rubric_data['correct_answers']
+    return {
+        'rubric': rubric_data['rubric'],
+        'question_block': f"Question:\n{question}\n\n" if question else "",
+        'answers_block': "Correct Answers:\n" + "\n".join(f"- {ans}" for ans in correct_answers) + "\n\n" if correct_answers else "",
+    }
+
+async def get_evaluation(client, api_key, prompt, temperature, rubric_text, question_block, answers_block, paper_text):
     """
     Gets evaluation from Grok model.
     """
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
-    question_text = f"Question:\n{question}\n\n" if question else ""
-    answers_text = f"Correct Answers:\n" + "\n".join([f"- {ans}" for ans in correct_answers]) + "\n\n" if correct_answers else ""
-    full_prompt = f"""Calibrate evaluations for community college freshmen: Be fair, constructive, and motivational. Typical papers should score 10-15/20, not failing unless severely deficient.\n\n{prompt}\n\n{question_text}{answers_text}Rubric:\n{rubric_text}\n\nStudent Paper:\n{paper_text}"""
-    data = {"messages": [{"role": "user", "content": full_prompt}], "model": "grok-4-fast-reasoning", "stream": False, "temperature": temperature}
-    response = requests.post("https://api.x.ai/v1/chat/completions", headers=headers, json=data)
-    response.raise_for_status()
-    return response.json()['choices'][0]['message']['content']
+    full_prompt = f"{_CALIBRATION_PREFIX}{prompt}\n\n{question_block}{answers_block}Rubric:\n{rubric_text}\n\nStudent Paper:\n{paper_text}"
+    return await chat_completion(client, api_key, full_prompt, temperature)
 
-def moderate_evaluations(api_key, evaluation_a, evaluation_b, rubric_text, question, correct_answers, paper_text):
+async def moderate_evaluations(client, api_key, evaluation_a, evaluation_b, rubric_text, question_block, answers_block, paper_text):
     """
     Moderates two evaluations using Grok.
     """
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
-    question_text = f"Question:\n{question}\n\n" if question else ""
-    answers_text = f"Correct Answers:\n" + "\n".join([f"- {ans}" for ans in correct_answers]) + "\n\n" if correct_answers else ""
-    prompt = f"""Calibrate evaluations for community college freshmen: Be fair, constructive, and motivational. Typical papers should score 10-15/20, not failing unless severely deficient.\n\n{MODERATOR_PROMPT}\n\n{question_text}{answers_text}Rubric:\n{rubric_text}\nStudent Paper:\n{paper_text}\nEvaluation from Grader A:\n{evaluation_a}\nEvaluation from Grader B:\n{evaluation_b}"""
-    data = {"messages": [{"role": "user", "content": prompt}], "model": "grok-4-fast-reasoning", "stream": False, "temperature": 0.7}
-    response = requests.post("https://api.x.ai/v1/chat/completions", headers=headers, json=data)
-    response.raise_for_status()
-    return response.json()['choices'][0]['message']['content']
+    prompt = f"{_MODERATOR_PREFIX}{question_block}{answers_block}Rubric:\n{rubric_text}\nStudent Paper:\n{paper_text}\nEvaluation from Grader A:\n{evaluation_a}\nEvaluation from Grader B:\n{evaluation_b}"
+    return await chat_completion(client, api_key, prompt, 0.7)
 
 def parse_score_summary(evaluation_text):
     """Extracts rubric criterion and total scores (earned, max) from the moderator output."""
-    criterion_pattern = re.compile(r'^\s*([^:\n]+):\s*(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)\b', re.MULTILINE)
-    total_pattern = re.compile(r'^\s*(?:Total|Overall(?:\s+Score)?|Final\s+Score):\s*(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)\b', re.IGNORECASE | re.MULTILINE)
-
     criterion_scores = OrderedDict()
-    for match in criterion_pattern.finditer(evaluation_text):
-        label = match.group(1).strip()
+    total_score = None
+    for match in _SCORE_RE.finditer(evaluation_text):
+        score = (float(match.group('earned')), float(match.group('maximum')))
+        if match.group('total_label'):
+            if total_score is None:
+                total_score = score
+            continue
+        label = match.group('crit').strip()
         if label.lower() == 'total':
             continue
-        earned = float(match.group(2))
-        maximum = float(match.group(3))
         if label not in criterion_scores:
-            criterion_scores[label] = (earned, maximum)
+            criterion_scores[label] = score
 
-    total_score = None
-    total_match = total_pattern.search(evaluation_text)
-    if total_match:
-        total_score = (float(total_match.group(1)), float(total_match.group(2)))
-    elif criterion_scores:
-        earned_sum = sum(score[0] for score in criterion_scores.values())
-        max_sum = sum(score[1] for score in criterion_scores.values())
+    if total_score is None and criterion_scores:
+        earned_sum = max_sum = 0.0
+        for earned, maximum in criterion_scores.values():
+            earned_sum += earned
+            max_sum += maximum
         total_score = (earned_sum, max_sum)
 
     return criterion_scores, total_score
@@ -82,95 +113,145 @@ def format_score_tuple(score_tuple):
 def save_batch_summary(output_folder, criteria, batch_results):
     """Writes a CSV table summarizing rubric scores for the batch."""
     summary_path = os.path.join(output_folder, "batch_scores.csv")
-    header = ["Essay"] + criteria + ["Total"]
+    header = ["Essay", *criteria, "Total"]
+
+    criteria = tuple(criteria)
+    rows = []
+    for result in batch_results:
+        scores = result['scores']
+        rows.append([
+            result['filename'],
+            *[format_score_tuple(scores.get(criterion)) for criterion in criteria],
+            format_score_tuple(result['total']),
+        ])
 
-    with open(summary_path, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
+    with open(summary_path, 'w', newline='', buffering=1 << 20) as csvfile:
+        writer = csv.writer(csvfile, lineterminator='\n')
         writer.writerow(header)
-        for result in batch_results:
-            row = [result['filename']]
-            for criterion in criteria:
-                score = result['scores'].get(criterion)
-                row.append(format_score_tuple(score))
-            row.append(format_score_tuple(result['total']))
-            writer.writerow(row)
+        writer.writerows(rows)
 
     print(f"\nBatch score summary saved to {summary_path}")
+    return summary_path
 
-def evaluate_paper(rubric_data, paper_text, xai_api_key):
+async def evaluate_paper(client, prompt_data, paper_text, xai_api_key):
     """
     Evaluates the student paper using a multi-agent system with Grok.
-    rubric_data: dict with 'rubric', 'question', 'correct_answers'
+    prompt_data: dict from prepare_prompt_data
     """
     try:
-        rubric_text = rubric_data['rubric']
-        question = rubric_data['question']
-        correct_answers = rubric_data['correct_answers']
-        
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            if not xai_api_key:
-                raise ValueError("XAI_API_KEY is required.")
-            future_a = executor.submit(get_evaluation, xai_api_key, GRADING_PROMPT, 0.4, rubric_text, question, correct_answers, paper_text)
-            future_b = executor.submit(get_evaluation, xai_api_key, GRADING_PROMPT, 0.8, rubric_text, question, correct_answers, paper_text)
-
-            evaluation_a = future_a.result()
-            evaluation_b = future_b.result()
-
-        final_evaluation = moderate_evaluations(xai_api_key, evaluation_a, evaluation_b, rubric_text, question, correct_answers, paper_text)
-        
+        rubric_text = prompt_data['rubric']
+        question_block = prompt_data['question_block']
+        answers_block = prompt_data['answers_block']
+
+        if not xai_api_key:
+            raise ValueError("XAI_API_KEY is required.")
+        evaluation_a, evaluation_b = await asyncio.gather(
+            get_evaluation(client, xai_api_key, GRADING_PROMPT, 0.4, rubric_text, question_block, answers_block, paper_text),
+            get_evaluation(client, xai_api_key, GRADING_PROMPT, 0.8, rubric_text, question_block, answers_block, paper_text),
+        )
+
+        final_evaluation = await moderate_evaluations(client, xai_api_key, evaluation_a, evaluation_b, rubric_text, question_block, answers_block, paper_text)
+
         return evaluation_a, evaluation_b, final_evaluation
 
     except Exception as e:
         raise RuntimeError(f"Error during API call: {e}")
 
-def run_grading(input_folder, output_folder, rubric_path, xai_api_key=None):
+def _group_duplicates(pdfs):
     """
-    Evaluates a batch of papers in a folder using Grok.
+    Groups (name, path) pairs by file content so identical PDFs are graded once.
+    Returns (digest, members) pairs; the first member of each group is graded.
     """
-    print("--- Starting Grading Process ---")
-    rubric_data = get_rubric_data(rubric_path)
+    groups = OrderedDict()
+    for filename, paper_path in pdfs:
+        groups.setdefault(file_digest(paper_path), []).append((filename, paper_path))
+    return list(groups.items())
 
-    if not os.path.isdir(input_folder):
-        raise FileNotFoundError(f"Input folder not found: {input_folder}")
-    if not os.path.isdir(output_folder):
-        os.makedirs(output_folder)
+async def _grade_batch(output_folder, prompt_data, groups, xai_api_key):
+    """
+    Grades every group concurrently, at most GRADE_CONCURRENCY at a time.
+    groups: (digest, members) pairs from _group_duplicates
+    Returns ({filename: result dict} for every paper whose scores could be parsed, [paths written]).
+    """
+    semaphore = asyncio.Semaphore(GRADE_CONCURRENCY)
+    results = {}
+    written = []
 
-    batch_results = []
-    criteria_order = []
+    async def grade_one(client, digest, members):
+        filename, paper_path = members[0]
 
-    for filename in os.listdir(input_folder):
-        if filename.lower().endswith(".pdf"):
-            paper_path = os.path.join(input_folder, filename)
-            output_path = os.path.join(output_folder, filename)
+        async with semaphore:
             print(f"\nGrading {paper_path}...")
-
             try:
-                paper_text = extract_text_from_pdf(paper_path)
-                evaluation_a, evaluation_b, final_evaluation = evaluate_paper(rubric_data, paper_text, xai_api_key)
+                paper_text = await asyncio.to_thread(cached_extract_text, paper_path, digest)
+                evaluation_a, evaluation_b, final_evaluation = await evaluate_paper(client, prompt_data, paper_text, xai_api_key)
 
                 evaluation_text = f"--- Agent 1 Evaluation ---\n{evaluation_a}\n--- End of Agent 1 Evaluation ---\n\n"
                 evaluation_text += f"--- Agent 2 Evaluation ---\n{evaluation_b}\n--- End of Agent 2 Evaluation ---\n\n"
                 evaluation_text += f"--- Final Moderator Evaluation ---\n{final_evaluation}\n--- End of Final Moderator Evaluation ---\n"
 
-                save_to_pdf(evaluation_text, output_path)
-                print(f"  - Saved evaluation to {output_path}")
+                for member_name, _ in members[1:]:
+                    print(f"  - {member_name} is identical to {filename}; reusing its evaluation.")
 
                 criterion_scores, total_score = parse_score_summary(final_evaluation)
-                if criterion_scores:
-                    for criterion in criterion_scores.keys():
-                        if criterion not in criteria_order:
-                            criteria_order.append(criterion)
-                    batch_results.append({
-                        'filename': filename,
-                        'scores': criterion_scores,
-                        'total': total_score
-                    })
-                else:
+                if not criterion_scores:
                     print("  - Warning: Could not extract score summary for batch table.")
 
+                for member_name, _ in members:
+                    output_path = os.path.join(output_folder, member_name)
+                    await asyncio.to_thread(save_to_pdf, evaluation_text, output_path)
+                    print(f"  - Saved evaluation to {output_path}")
+                    written.append(output_path)
+                    if criterion_scores:
+                        results[member_name] = {
+                            'filename': member_name,
+                            'scores': criterion_scores,
+                            'total': total_score
+                        }
+
             except Exception as e:
                 print(f"Error evaluating {paper_path}: {e}", file=sys.stderr)
+
+    # The client is bound to this event loop, so it lives for one batch rather than the module.
+    async with _make_client() as client:
+        await asyncio.gather(*(grade_one(client, digest, members) for digest, members in groups))
+    return results, written
+
+def run_grading(input_folder, output_folder, rubric_path, xai_api_key=None, rubric_data=None):
+    """
+    Evaluates a batch of papers in a folder using Grok.
+    rubric_data: optional pre-parsed rubric; parsed from rubric_path when omitted.
+    Returns the sorted paths of the evaluation PDFs and summary CSV written.
+    """
+    print("--- Starting Grading Process ---")
+    if rubric_data is None:
+        rubric_data = cached_rubric_data(rubric_path)
+    prompt_data = prepare_prompt_data(rubric_data)
+
+    if not os.path.isdir(input_folder):
+        raise FileNotFoundError(f"Input folder not found: {input_folder}")
+    if not os.path.isdir(output_folder):
+        os.makedirs(output_folder)
+
+    pdfs = list_pdfs(input_folder)
+    results, written = asyncio.run(_grade_batch(output_folder, prompt_data, _group_duplicates(pdfs), xai_api_key))
+
+    batch_results = []
+    criteria_order = []
+    for filename, _ in pdfs:
+        result = results.get(filename)
+        if not result:
+            continue
+        for criterion in result['scores'].keys():
+            if criterion not in criteria_order:
+                criteria_order.append(criterion)
+        batch_results.append(result)
+
     if batch_results and criteria_order:
-        save_batch_summary(output_folder, criteria_order, batch_results)
+        written.append(save_batch_summary(output_folder, criteria_order, batch_results))
+
+    trim_cache(TEXT_CACHE, TEXT_CACHE_SIZE)
+    trim_cache(RUBRIC_CACHE, RUBRIC_CACHE_SIZE)
 
     print("\n--- Grading Process Complete ---")
+    return sorted(written)
@@ -1,16 +1,26 @@
 from __future__ import annotations
 
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hashlib
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
 import shutil
 import zipfile
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from threading import Lock
-from typing import Dict, List, Optional, Sequence, Tuple
+from threading import RLock
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
 
+import aiofiles
+from fastapi import UploadFile
+
+from .job_store import JobStore
 from .pipeline import GradeFactoryPipeline, JobPaths, StageResult
-from .utils import load_api_keys
+from .utils import cached_rubric_data, file_digest, load_api_keys, unique_filename
 
 
 JOB_STATUS_PENDING = "pending"
@@ -18,6 +28,30 @@ JOB_STATUS_RUNNING = "running"
 JOB_STATUS_COMPLETED = "completed"
 JOB_STATUS_FAILED = "failed"
 
+UPLOAD_CHUNK_SIZE = 1 << 20
+MAX_PDF_BYTES = int(os.getenv("GF_MAX_PDF_BYTES", str(100 * 1024 * 1024)))
+MAX_BATCH_BYTES = int(os.getenv("GF_MAX_BATCH_BYTES", str(1024 * 1024 * 1024)))
+RUBRIC_CACHE_SIZE = 32
+RECENT_JOBS_CACHE_SIZE = 64
+JOB_LIST_LIMIT = 200
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds MAX_PDF_BYTES or MAX_BATCH_BYTES."""
+
+
+@dataclass
+class UploadBudget:
+    """Running byte count shared by every file streamed for one request."""
+
+    limit: int = MAX_BATCH_BYTES
+    used: int = 0
+
+    def consume(self, size: int) -> None:
+        self.used += size
+        if self.used > self.limit:
+            raise UploadTooLarge(f"Upload exceeds the batch limit of {self.limit} bytes.")
+
 
 @dataclass
 class StageSnapshot:
@@ -38,21 +72,91 @@ class JobRecord:
     paths: JobPaths
     stages: Dict[str, StageSnapshot]
     error: Optional[str] = None
+    # SHA-256 of the uploaded rubric, computed while it streams to disk.
+    rubric_digest: Optional[str] = None
+    # PID of the server worker that runs the job; several workers may share the store.
+    owner_pid: Optional[int] = None
+    # Workspace paths never change, so their string forms are computed once.
+    path_strings: Dict[str, str] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.path_strings = {
+            "raw_input": str(self.paths.raw_input),
+            "processed": str(self.paths.processed),
+            "graded": str(self.paths.graded),
+            "rubric": str(self.paths.rubric),
+        }
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill(pid, 0) would send CTRL_C_EVENT on Windows; assume the owner is gone.
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _run_processing_worker(
+    pipeline: GradeFactoryPipeline,
+    raw_input_path: Path,
+    processed_path: Path,
+    name_flag: bool,
+    api_key: Optional[str],
+) -> StageResult:
+    """Entry point for the processing stage inside a worker process."""
+    return pipeline.run_processing(
+        raw_input_path,
+        output_folder=processed_path,
+        name_flag=name_flag,
+        xai_api_key=api_key,
+    )
 
 
 class JobManager:
     """Coordinates background execution of GradeFactory pipeline jobs."""
 
-    def __init__(self, pipeline: Optional[GradeFactoryPipeline] = None, max_workers: int = 2) -> None:
+    def __init__(
+        self,
+        pipeline: Optional[GradeFactoryPipeline] = None,
+        proc_workers: Optional[int] = None,
+        grade_workers: Optional[int] = None,
+        store: Optional[JobStore] = None,
+    ) -> None:
         self.pipeline = pipeline or GradeFactoryPipeline()
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)
-        self.jobs: Dict[str, JobRecord] = {}
-        self._lock = Lock()
+        self._store = store or JobStore(self.pipeline.jobs_root / "jobs.sqlite3")
+        # Processing (OCR) and grading (network fan-out) get separate pools so a
+        # long OCR job cannot starve grading jobs. Processing threads only do the
+        # bookkeeping; the stage itself runs in a worker process to get off the GIL.
+        self._proc_workers = proc_workers or int(os.getenv("GF_PROC_WORKERS", os.cpu_count() or 2))
+        self._proc_pool = ThreadPoolExecutor(max_workers=self._proc_workers, thread_name_prefix="gf-proc")
+        self._proc_processes = self._new_process_pool()
+        self._grade_pool = ThreadPoolExecutor(
+            max_workers=grade_workers or int(os.getenv("GF_GRADE_WORKERS", "8")),
+            thread_name_prefix="gf-grade",
+        )
+        # Pending/running jobs are mutated in place and always stay in memory; finished
+        # jobs live in the store with only the most recently used ones kept hot.
+        self._active: Dict[str, JobRecord] = {}
+        self._recent: OrderedDict[str, JobRecord] = OrderedDict()
+        self._lock = RLock()
+        self._rubric_cache: OrderedDict[str, Mapping[str, object]] = OrderedDict()
+        # Event-loop queues of clients streaming a job's progress, fed from worker threads.
+        self._watchers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
         self._api_key = load_api_keys()
+        self._fail_interrupted_jobs()
 
     def shutdown(self, wait: bool = False) -> None:
-        self.executor.shutdown(wait=wait)
-
+        self._proc_pool.shutdown(wait=wait)
+        self._proc_processes.shutdown(wait=wait)
+        self._grade_pool.shutdown(wait=wait)
+        if wait:
+            # Without waiting, worker threads may still be recording results.
+            self._store.close()
 
     def create_job(self, job_type: str) -> JobRecord:
         paths = self.pipeline.create_job_workspace()
@@ -66,83 +170,221 @@ class JobManager:
             updated_at=now,
             paths=paths,
             stages=stages,
+            owner_pid=os.getpid(),
         )
         with self._lock:
-            self.jobs[record.job_id] = record
+            self._active[record.job_id] = record
+            self._store.upsert(record)
         return record
 
     def list_jobs(self) -> List[JobRecord]:
         with self._lock:
-            return list(self.jobs.values())
+            return self._store.list_recent(JOB_LIST_LIMIT)
+
+    def list_snapshots(self) -> List[Dict[str, object]]:
+        with self._lock:
+            return [self._serialize_job(record) for record in self._store.list_recent(JOB_LIST_LIMIT)]
 
     def get_job(self, job_id: str) -> Optional[JobRecord]:
         with self._lock:
-            return self.jobs.get(job_id)
+            return self._lookup(job_id)
 
     def delete_job(self, job_id: str, *, remove_files: bool = True) -> JobRecord:
         with self._lock:
-            record = self.jobs.get(job_id)
+            record = self._lookup(job_id)
             if not record:
                 raise KeyError(job_id)
             if record.status in {JOB_STATUS_PENDING, JOB_STATUS_RUNNING}:
                 raise RuntimeError('Cannot delete a job that is pending or running.')
-            del self.jobs[job_id]
+            self._recent.pop(job_id, None)
+            self._store.delete(job_id)
         if remove_files and record.paths.root.exists():
             shutil.rmtree(record.paths.root, ignore_errors=True)
         return record
 
+    def discard_job(self, job_id: str) -> None:
+        """Drops a job that was never started, e.g. because its upload was rejected."""
+        with self._lock:
+            record = self._active.pop(job_id, None)
+            self._store.delete(job_id)
+        if record:
+            shutil.rmtree(record.paths.root, ignore_errors=True)
+
     def snapshot(self, job_id: str) -> Optional[Dict[str, object]]:
-        record = self.get_job(job_id)
-        if not record:
-            return None
-        return self._serialize_job(record)
+        with self._lock:
+            record = self._lookup(job_id)
+            if not record:
+                return None
+            return self._serialize_job(record)
+
+    def watch(self, job_id: str) -> Optional[asyncio.Queue]:
+        """
+        Subscribes the running event loop to a job's snapshots.
+        The queue starts with the current snapshot and receives one per update.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            record = self._lookup(job_id)
+            if not record:
+                return None
+            queue.put_nowait(self._serialize_job(record))
+            if record.status not in {JOB_STATUS_COMPLETED, JOB_STATUS_FAILED}:
+                self._watchers.setdefault(job_id, []).append((asyncio.get_running_loop(), queue))
+        return queue
 
-    def write_files(self, job: JobRecord, files: Sequence[Tuple[str, bytes]], destination: Path) -> List[str]:
+    def unwatch(self, job_id: str, queue: asyncio.Queue) -> None:
+        with self._lock:
+            watchers = self._watchers.get(job_id)
+            if not watchers:
+                return
+            watchers[:] = [watcher for watcher in watchers if watcher[1] is not queue]
+            if not watchers:
+                del self._watchers[job_id]
+
+    async def stream_uploads(
+        self,
+        job: JobRecord,
+        uploads: Sequence[UploadFile],
+        destination: Path,
+        *,
+        budget: Optional[UploadBudget] = None,
+        taken: Optional[set] = None,
+    ) -> List[Path]:
+        """
+        Writes uploads into destination concurrently. Names already in taken (lower-cased),
+        and repeats within uploads, get a _2, _3, ... suffix; the names used are added to taken.
+        """
         destination.mkdir(parents=True, exist_ok=True)
-        stored: List[str] = []
-        for index, (filename, data) in enumerate(files, start=1):
-            safe_name = Path(filename or f"upload_{index}.pdf").name
-            target = destination / safe_name
-            target.write_bytes(data)
-            stored.append(str(target.relative_to(job.paths.root)))
-        return stored
-
-    def write_rubric(self, job: JobRecord, filename: str, data: bytes) -> Path:
+        budget = budget or UploadBudget()
+        # Files are written at the same time, so two parts with the same filename
+        # (e.g. picked from different folders) must not share a target.
+        targets: List[Path] = []
+        taken = set() if taken is None else taken
+        for upload in uploads:
+            target = destination / unique_filename(Path(upload.filename or "upload.pdf").name, taken)
+            targets.append(target)
+        tasks = [
+            asyncio.ensure_future(self._stream_to(upload, target, budget))
+            for upload, target in zip(uploads, targets)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+            return targets
+        except BaseException:
+            # Stop the sibling writes as soon as one file is rejected.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def stream_rubric(
+        self,
+        job: JobRecord,
+        upload: UploadFile,
+        *,
+        budget: Optional[UploadBudget] = None,
+    ) -> Path:
         job.paths.rubric.mkdir(parents=True, exist_ok=True)
-        safe_name = Path(filename or "rubric").name
+        safe_name = Path(upload.filename or "rubric").name
         target = job.paths.rubric / safe_name
-        target.write_bytes(data)
+        digest = hashlib.sha256()
+        await self._stream_to(upload, target, budget, digest)
+        job.rubric_digest = digest.hexdigest()
         return target
 
+    async def _stream_to(
+        self,
+        upload: UploadFile,
+        target: Path,
+        budget: Optional[UploadBudget],
+        digest: Optional[hashlib._Hash] = None,
+    ) -> None:
+        written = 0
+        try:
+            async with aiofiles.open(target, "wb") as handle:
+                while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > MAX_PDF_BYTES:
+                        raise UploadTooLarge(f"{target.name} exceeds the per-file limit of {MAX_PDF_BYTES} bytes.")
+                    if budget:
+                        budget.consume(len(chunk))
+                    if digest:
+                        digest.update(chunk)
+                    await handle.write(chunk)
+        except BaseException:
+            target.unlink(missing_ok=True)
+            raise
+
+    def get_parsed_rubric(self, rubric_path: Path, digest: Optional[str] = None) -> Mapping[str, object]:
+        digest = digest or file_digest(rubric_path)
+        with self._lock:
+            parsed = self._rubric_cache.get(digest)
+            if parsed is not None:
+                self._rubric_cache.move_to_end(digest)
+                return parsed
+
+        parsed = cached_rubric_data(str(rubric_path), digest=digest)
+        with self._lock:
+            self._rubric_cache[digest] = parsed
+            self._rubric_cache.move_to_end(digest)
+            while len(self._rubric_cache) > RUBRIC_CACHE_SIZE:
+                self._rubric_cache.popitem(last=False)
+        return parsed
+
     def start_processing_job(self, job_id: str, *, name_flag: bool = True) -> None:
-        self._submit(self._run_processing_job, job_id, name_flag)
+        self._proc_pool.submit(self._run_processing_job, job_id, name_flag)
 
     def start_grading_job(self, job_id: str, rubric_path: Path) -> None:
-        self._submit(self._run_grading_job, job_id, rubric_path)
+        self._grade_pool.submit(self._run_grading_job, job_id, rubric_path)
 
     def start_full_pipeline(self, job_id: str, rubric_path: Path, *, name_flag: bool = True) -> None:
-        self._submit(self._run_full_pipeline, job_id, rubric_path, name_flag)
+        processing = self._proc_pool.submit(self._run_processing_job, job_id, name_flag)
+        processing.add_done_callback(lambda done: self._chain_grading(done, job_id, rubric_path))
 
-    def _submit(self, fn, job_id: str, *args) -> None:
-        self.executor.submit(fn, job_id, *args)
+    def _chain_grading(self, processing: Future, job_id: str, rubric_path: Path) -> None:
+        if processing.cancelled() or not processing.result():
+            return
+        self._grade_pool.submit(self._run_grading_job, job_id, rubric_path)
 
-    def _run_processing_job(self, job_id: str, name_flag: bool) -> None:
+    def _run_processing_job(self, job_id: str, name_flag: bool) -> bool:
         self._mark_job_running(job_id)
         self._mark_stage_status(job_id, "processing", JOB_STATUS_RUNNING)
         try:
             record = self.get_job(job_id)
             if not record:
                 raise ValueError(f"Job {job_id} not found")
-            result = self.pipeline.run_processing(
+            result = self._run_in_process(
+                _run_processing_worker,
+                self.pipeline,
                 record.paths.raw_input,
-                output_folder=record.paths.processed,
-                name_flag=name_flag,
-                xai_api_key=self._api_key,
+                record.paths.processed,
+                name_flag,
+                self._api_key,
             )
             self._complete_stage(job_id, "processing", result)
             self._mark_job_completed(job_id)
+            return True
         except Exception as exc:
             self._fail_stage(job_id, "processing", exc)
+            return False
+
+    def _new_process_pool(self) -> ProcessPoolExecutor:
+        # Spawn rather than fork: the parent runs threads and gRPC/HTTP clients.
+        return ProcessPoolExecutor(
+            max_workers=self._proc_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _run_in_process(self, fn, *args):
+        pool = self._proc_processes
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # A crashed worker poisons the whole pool; replace it so later jobs still run.
+            with self._lock:
+                if self._proc_processes is pool:
+                    self._proc_processes = self._new_process_pool()
+            raise
 
     def _run_grading_job(self, job_id: str, rubric_path: Path) -> None:
         self._mark_job_running(job_id)
@@ -156,43 +398,13 @@ class JobManager:
                 output_folder=record.paths.graded,
                 rubric_path=rubric_path,
                 xai_api_key=self._api_key,
+                rubric_data=self.get_parsed_rubric(rubric_path, record.rubric_digest),
             )
             self._complete_stage(job_id, "grading", result)
             self._mark_job_completed(job_id)
         except Exception as exc:
             self._fail_stage(job_id, "grading", exc)
 
-    def _run_full_pipeline(self, job_id: str, rubric_path: Path, name_flag: bool) -> None:
-        self._mark_job_running(job_id)
-        self._mark_stage_status(job_id, "processing", JOB_STATUS_RUNNING)
-        try:
-            record = self.get_job(job_id)
-            if not record:
-                raise ValueError(f"Job {job_id} not found")
-            processing = self.pipeline.run_processing(
-                record.paths.raw_input,
-                output_folder=record.paths.processed,
-                name_flag=name_flag,
-                xai_api_key=self._api_key,
-            )
-            self._complete_stage(job_id, "processing", processing)
-        except Exception as exc:
-            self._fail_stage(job_id, "processing", exc)
-            return
-
-        self._mark_stage_status(job_id, "grading", JOB_STATUS_RUNNING)
-        try:
-            grading = self.pipeline.run_grading(
-                record.paths.processed,
-                output_folder=record.paths.graded,
-                rubric_path=rubric_path,
-                xai_api_key=self._api_key,
-            )
-            self._complete_stage(job_id, "grading", grading)
-            self._mark_job_completed(job_id)
-        except Exception as exc:
-            self._fail_stage(job_id, "grading", exc)
-
     def _initial_stages(self, job_type: str) -> Dict[str, StageSnapshot]:
         stages: Dict[str, StageSnapshot] = {}
         if job_type in {"process", "full"}:
@@ -201,38 +413,94 @@ class JobManager:
             stages["grading"] = StageSnapshot("grading")
         return stages
 
+    def _lookup(self, job_id: str) -> Optional[JobRecord]:
+        """Finds a job in memory or the store. Caller must hold the lock."""
+        record = self._active.get(job_id)
+        if record:
+            return record
+        record = self._recent.get(job_id)
+        if record:
+            self._recent.move_to_end(job_id)
+            return record
+        record = self._store.get(job_id)
+        if record:
+            self._remember(record)
+        return record
+
+    def _remember(self, record: JobRecord) -> None:
+        self._recent[record.job_id] = record
+        self._recent.move_to_end(record.job_id)
+        while len(self._recent) > RECENT_JOBS_CACHE_SIZE:
+            self._recent.popitem(last=False)
+
+    def _persist(self, record: JobRecord) -> None:
+        """Writes a mutated record through to the store. Caller must hold the lock."""
+        record.updated_at = datetime.now(timezone.utc)
+        self._store.upsert(record)
+        if record.status in {JOB_STATUS_COMPLETED, JOB_STATUS_FAILED}:
+            self._active.pop(record.job_id, None)
+            self._remember(record)
+        self._notify(record)
+
+    def _notify(self, record: JobRecord) -> None:
+        """Pushes a fresh snapshot to every client watching the job. Caller must hold the lock."""
+        watchers = self._watchers.get(record.job_id)
+        if not watchers:
+            return
+        snapshot = self._serialize_job(record)
+        for loop, queue in watchers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, snapshot)
+            except RuntimeError:
+                # The client's event loop has already shut down.
+                continue
+        if record.status in {JOB_STATUS_COMPLETED, JOB_STATUS_FAILED}:
+            del self._watchers[record.job_id]
+
+    def _fail_interrupted_jobs(self) -> None:
+        # Other live workers' jobs are still running; only jobs whose worker is gone were interrupted.
+        for record in self._store.list_by_status([JOB_STATUS_PENDING, JOB_STATUS_RUNNING]):
+            if record.owner_pid and record.owner_pid != os.getpid() and _process_alive(record.owner_pid):
+                continue
+            record.status = JOB_STATUS_FAILED
+            record.error = "Interrupted by a server restart."
+            for stage in record.stages.values():
+                if stage.status == JOB_STATUS_RUNNING:
+                    stage.status = JOB_STATUS_FAILED
+            self._store.upsert(record)
+
     def _mark_job_running(self, job_id: str) -> None:
         with self._lock:
-            record = self.jobs.get(job_id)
+            record = self._active.get(job_id)
             if not record:
                 return
             if record.status == JOB_STATUS_PENDING:
                 record.status = JOB_STATUS_RUNNING
-            record.updated_at = datetime.now(timezone.utc)
+            self._persist(record)
 
     def _mark_job_completed(self, job_id: str) -> None:
         with self._lock:
-            record = self.jobs.get(job_id)
+            record = self._active.get(job_id)
             if not record:
                 return
             if all(stage.status == JOB_STATUS_COMPLETED for stage in record.stages.values()):
                 record.status = JOB_STATUS_COMPLETED
-                record.updated_at = datetime.now(timezone.utc)
+                self._persist(record)
 
     def _mark_stage_status(self, job_id: str, stage_name: str, status: str) -> None:
         with self._lock:
-            record = self.jobs.get(job_id)
+            record = self._active.get(job_id)
             if not record:
                 return
             stage = record.stages.get(stage_name)
             if not stage:
                 return
             stage.status = status
-            record.updated_at = datetime.now(timezone.utc)
+            self._persist(record)
 
     def _complete_stage(self, job_id: str, stage_name: str, result: StageResult) -> None:
         with self._lock:
-            record = self.jobs.get(job_id)
+            record = self._active.get(job_id)
             if not record:
                 return
             stage = record.stages.get(stage_name)
@@ -250,7 +518,7 @@ class JobManager:
             if bundle_path:
                 stage.output_files.append(self._relative_output(record.paths.root, bundle_path))
 
-            record.updated_at = datetime.now(timezone.utc)
+            self._persist(record)
 
     def _bundle_stage_outputs(
         self,
@@ -290,12 +558,11 @@ class JobManager:
     def _fail_stage(self, job_id: str, stage_name: str, exc: Exception) -> None:
         message = str(exc)
         with self._lock:
-            record = self.jobs.get(job_id)
+            record = self._active.get(job_id)
             if not record:
                 return
             record.status = JOB_STATUS_FAILED
             record.error = message
-            record.updated_at = datetime.now(timezone.utc)
             stage = record.stages.get(stage_name)
             if stage:
                 stage.status = JOB_STATUS_FAILED
@@ -303,6 +570,7 @@ class JobManager:
                     stage.stderr += f"\n{message}"
                 else:
                     stage.stderr = message
+            self._persist(record)
 
     def _relative_output(self, job_root: Path, path: Path) -> str:
         try:
@@ -311,27 +579,24 @@ class JobManager:
             return str(path)
 
     def _serialize_job(self, record: JobRecord) -> Dict[str, object]:
-        return {
-            "id": record.job_id,
-            "type": record.job_type,
-            "status": record.status,
-            "created_at": record.created_at.isoformat(),
-            "updated_at": record.updated_at.isoformat(),
-            "error": record.error,
-            "stages": [
-                {
-                    "name": stage.name,
-                    "status": stage.status,
-                    "stdout": stage.stdout,
-                    "stderr": stage.stderr,
-                    "output_files": stage.output_files,
-                }
-                for stage in record.stages.values()
-            ],
-            "paths": {
-                "raw_input": str(record.paths.raw_input),
-                "processed": str(record.paths.processed),
-                "graded": str(record.paths.graded),
-                "rubric": str(record.paths.rubric),
-            },
-        }
+        # Stage writers mutate records in place, so copy everything under the lock.
+        with self._lock:
+            return {
+                "id": record.job_id,
+                "type": record.job_type,
+                "status": record.status,
+                "created_at": record.created_at.isoformat(),
+                "updated_at": record.updated_at.isoformat(),
+                "error": record.error,
+                "stages": [
+                    {
+                        "name": stage.name,
+                        "status": stage.status,
+                        "stdout": stage.stdout,
+                        "stderr": stage.stderr,
+                        "output_files": stage.output_files[:],
+                    }
+                    for stage in record.stages.values()
+                ],
+                "paths": record.path_strings,
+            }
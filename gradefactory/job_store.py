@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import TYPE_CHECKING, List, Optional, Sequence
+
+from .pipeline import JobPaths
+
+if TYPE_CHECKING:
+    from .job_manager import JobRecord
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    job_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    error TEXT,
+    root TEXT NOT NULL,
+    raw_input TEXT NOT NULL,
+    processed TEXT NOT NULL,
+    graded TEXT NOT NULL,
+    rubric TEXT NOT NULL,
+    artifacts TEXT NOT NULL,
+    owner_pid INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at);
+CREATE TABLE IF NOT EXISTS stages (
+    job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stdout TEXT NOT NULL,
+    stderr TEXT NOT NULL,
+    output_files TEXT NOT NULL,
+    PRIMARY KEY (job_id, name)
+);
+"""
+
+
+class JobStore:
+    """SQLite persistence for job records, so finished jobs need not stay in memory."""
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = Path(db_path)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "owner_pid" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN owner_pid INTEGER")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def upsert(self, record: JobRecord) -> None:
+        paths = record.paths
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO jobs (job_id, job_type, status, created_at, updated_at, error,
+                                  root, raw_input, processed, graded, rubric, artifacts, owner_pid)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (job_id) DO UPDATE SET
+                    status = excluded.status,
+                    updated_at = excluded.updated_at,
+                    error = excluded.error,
+                    owner_pid = excluded.owner_pid
+                """,
+                (
+                    record.job_id,
+                    record.job_type,
+                    record.status,
+                    record.created_at.isoformat(),
+                    record.updated_at.isoformat(),
+                    record.error,
+                    str(paths.root),
+                    str(paths.raw_input),
+                    str(paths.processed),
+                    str(paths.graded),
+                    str(paths.rubric),
+                    str(paths.artifacts),
+                    record.owner_pid,
+                ),
+            )
+            self._conn.executemany(
+                """
+                INSERT OR REPLACE INTO stages (job_id, position, name, status, stdout, stderr, output_files)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        record.job_id,
+                        position,
+                        stage.name,
+                        stage.status,
+                        stage.stdout,
+                        stage.stderr,
+                        json.dumps(stage.output_files),
+                    )
+                    for position, stage in enumerate(record.stages.values())
+                ],
+            )
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            stage_rows = self._conn.execute(
+                "SELECT * FROM stages WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        return self._to_record(row, stage_rows)
+
+    def list_recent(self, limit: int = 200) -> List[JobRecord]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs ORDER BY updated_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+            if not rows:
+                return []
+            placeholders = ",".join("?" for _ in rows)
+            stage_rows = self._conn.execute(
+                f"SELECT * FROM stages WHERE job_id IN ({placeholders}) ORDER BY job_id, position",
+                [row["job_id"] for row in rows],
+            ).fetchall()
+
+        stages_by_job = {}
+        for stage_row in stage_rows:
+            stages_by_job.setdefault(stage_row["job_id"], []).append(stage_row)
+        return [self._to_record(row, stages_by_job.get(row["job_id"], [])) for row in rows]
+
+    def delete(self, job_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def list_by_status(self, statuses: Sequence[str]) -> List[JobRecord]:
+        placeholders = ",".join("?" for _ in statuses)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT job_id FROM jobs WHERE status IN ({placeholders})", list(statuses)
+            ).fetchall()
+        return [record for record in (self.get(row["job_id"]) for row in rows) if record]
+
+    def _to_record(self, row: sqlite3.Row, stage_rows: List[sqlite3.Row]) -> JobRecord:
+        from .job_manager import JobRecord, StageSnapshot
+
+        paths = JobPaths(
+            row["job_id"],
+            Path(row["root"]),
+            Path(row["raw_input"]),
+            Path(row["processed"]),
+            Path(row["graded"]),
+            Path(row["rubric"]),
+            Path(row["artifacts"]),
+        )
+        stages = {
+            stage_row["name"]: StageSnapshot(
+                name=stage_row["name"],
+                status=stage_row["status"],
+                stdout=stage_row["stdout"],
+                stderr=stage_row["stderr"],
+                output_files=json.loads(stage_row["output_files"]),
+            )
+            for stage_row in stage_rows
+        }
+        return JobRecord(
+            job_id=row["job_id"],
+            job_type=row["job_type"],
+            status=row["status"],
+            created_at=datetime.fromisoformat(row["created_at"]),
+            updated_at=datetime.fromisoformat(row["updated_at"]),
+            paths=paths,
+            stages=stages,
+            error=row["error"],
+            owner_pid=row["owner_pid"],
+        )
@@ -45,40 +45,30 @@ def main():
         xai_api_key = load_api_keys()
 
         if args.process:
-            result = PIPELINE.run_processing(
+            # Output streams straight to the console rather than being buffered for a report.
+            PIPELINE.run_processing(
                 args.input_folder,
                 name_flag=args.name,
                 xai_api_key=xai_api_key,
+                capture=False,
             )
-            sys.stdout.write(result.stdout)
-            if result.stderr:
-                sys.stderr.write(result.stderr)
 
         elif args.grade:
-            result = PIPELINE.run_grading(
+            PIPELINE.run_grading(
                 ESSAYS_TO_GRADE_FOLDER,
                 rubric_path=Path(args.rubric),
                 xai_api_key=xai_api_key,
+                capture=False,
             )
-            sys.stdout.write(result.stdout)
-            if result.stderr:
-                sys.stderr.write(result.stderr)
 
         elif args.full_pipeline:
-            result = PIPELINE.run_full_pipeline(
+            PIPELINE.run_full_pipeline(
                 args.input_folder,
                 rubric_path=Path(args.rubric),
                 name_flag=args.name,
                 xai_api_key=xai_api_key,
+                capture=False,
             )
-            if result.processing:
-                sys.stdout.write(result.processing.stdout)
-                if result.processing.stderr:
-                    sys.stderr.write(result.processing.stderr)
-            if result.grading:
-                sys.stdout.write(result.grading.stdout)
-                if result.grading.stderr:
-                    sys.stderr.write(result.grading.stderr)
 
     except (ValueError, FileNotFoundError, IOError, RuntimeError) as e:
         print(f"An error occurred: {e}", file=sys.stderr)
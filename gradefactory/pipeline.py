@@ -1,16 +1,96 @@
 from __future__ import annotations
 
 import io
+import sys
 import uuid
-from contextlib import redirect_stdout, redirect_stderr
+from collections import deque
+from contextvars import ContextVar
 from dataclasses import dataclass
+from threading import Lock
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, List, Mapping, Optional, Tuple
 
 from .grading import run_grading
 from .processing import run_processing
 
 
+CAPTURE_MAX_LINES = 10_000
+
+
+class _TailBuffer(io.TextIOBase):
+    """Text sink that keeps only the last max_lines lines written to it."""
+
+    def __init__(self, max_lines: int = CAPTURE_MAX_LINES) -> None:
+        self._lines: deque = deque(maxlen=max_lines)
+        self._partial = ""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        self._lines.extend(lines)
+        return len(text)
+
+    def getvalue(self) -> str:
+        if not self._lines:
+            return self._partial
+        return "\n".join(self._lines) + "\n" + self._partial
+
+
+_captured_stdout: ContextVar[Optional[_TailBuffer]] = ContextVar("gf_captured_stdout", default=None)
+_captured_stderr: ContextVar[Optional[_TailBuffer]] = ContextVar("gf_captured_stderr", default=None)
+_router_lock = Lock()
+
+
+class _ContextStream:
+    """
+    Stands in for sys.stdout/sys.stderr and writes to the buffer of the stage running
+    in the current context, or to the original stream outside any capture.
+    Stages run concurrently on worker threads, so swapping sys.stdout per stage would
+    mix their logs; context variables follow each thread and the asyncio tasks it spawns.
+    """
+
+    def __init__(self, var: ContextVar, fallback) -> None:
+        self._var = var
+        self._fallback = fallback
+
+    def write(self, text: str) -> int:
+        return (self._var.get() or self._fallback).write(text)
+
+    def flush(self) -> None:
+        (self._var.get() or self._fallback).flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self._fallback, name)
+
+
+def _install_stream_router() -> None:
+    with _router_lock:
+        if not isinstance(sys.stdout, _ContextStream):
+            sys.stdout = _ContextStream(_captured_stdout, sys.stdout)
+        if not isinstance(sys.stderr, _ContextStream):
+            sys.stderr = _ContextStream(_captured_stderr, sys.stderr)
+
+
+def _run_captured(capture: bool, fn: Callable[..., List[str]], *args, **kwargs) -> Tuple[List[str], str, str]:
+    """Runs a stage, returning (result, stdout, stderr). Without capture, output goes straight to the console."""
+    if not capture:
+        return fn(*args, **kwargs), "", ""
+    _install_stream_router()
+    stdout_buffer = _TailBuffer()
+    stderr_buffer = _TailBuffer()
+    stdout_token = _captured_stdout.set(stdout_buffer)
+    stderr_token = _captured_stderr.set(stderr_buffer)
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        _captured_stdout.reset(stdout_token)
+        _captured_stderr.reset(stderr_token)
+    return result, stdout_buffer.getvalue(), stderr_buffer.getvalue()
+
+
 @dataclass
 class StageResult:
     output_files: List[Path]
@@ -74,6 +154,7 @@ class GradeFactoryPipeline:
         output_folder: Optional[Path] = None,
         name_flag: bool = True,
         xai_api_key: Optional[str] = None,
+        capture: bool = True,
     ) -> StageResult:
         input_path = Path(input_folder)
         if not input_path.is_dir():
@@ -82,19 +163,11 @@ class GradeFactoryPipeline:
         destination = Path(output_folder) if output_folder else self.processed_dir
         destination.mkdir(parents=True, exist_ok=True)
 
-        before = {p.name for p in destination.iterdir() if p.is_file()}
-
-        stdout_buffer = io.StringIO()
-        stderr_buffer = io.StringIO()
-
-        with redirect_stdout(stdout_buffer), redirect_stderr(stderr_buffer):
-            run_processing(str(input_path), str(destination), name_flag, xai_api_key)
-
-        stdout_value = stdout_buffer.getvalue()
-        stderr_value = stderr_buffer.getvalue()
+        written, stdout_value, stderr_value = _run_captured(
+            capture, run_processing, input_path, destination, name_flag, xai_api_key
+        )
 
-        after = {p.name: p for p in destination.iterdir() if p.is_file()}
-        new_files = [after[name] for name in sorted(after.keys()) if name not in before]
+        new_files = [Path(path) for path in written]
 
         return StageResult(new_files, stdout_value, stderr_value)
 
@@ -105,6 +178,8 @@ class GradeFactoryPipeline:
         output_folder: Optional[Path] = None,
         rubric_path: Path,
         xai_api_key: Optional[str] = None,
+        rubric_data: Optional[Mapping[str, object]] = None,
+        capture: bool = True,
     ) -> StageResult:
         input_path = Path(input_folder)
         if not input_path.is_dir():
@@ -117,19 +192,11 @@ class GradeFactoryPipeline:
         destination = Path(output_folder) if output_folder else self.graded_dir
         destination.mkdir(parents=True, exist_ok=True)
 
-        before = {p.name for p in destination.iterdir() if p.is_file()}
-
-        stdout_buffer = io.StringIO()
-        stderr_buffer = io.StringIO()
-
-        with redirect_stdout(stdout_buffer), redirect_stderr(stderr_buffer):
-            run_grading(str(input_path), str(destination), str(rubric), xai_api_key)
-
-        stdout_value = stdout_buffer.getvalue()
-        stderr_value = stderr_buffer.getvalue()
+        written, stdout_value, stderr_value = _run_captured(
+            capture, run_grading, input_path, destination, rubric, xai_api_key, rubric_data=rubric_data
+        )
 
-        after = {p.name: p for p in destination.iterdir() if p.is_file()}
-        new_files = [after[name] for name in sorted(after.keys()) if name not in before]
+        new_files = [Path(path) for path in written]
 
         return StageResult(new_files, stdout_value, stderr_value)
 
@@ -142,6 +209,7 @@ class GradeFactoryPipeline:
         xai_api_key: Optional[str] = None,
         processed_output: Optional[Path] = None,
         graded_output: Optional[Path] = None,
+        capture: bool = True,
     ) -> PipelineResult:
         target_processed = Path(processed_output) if processed_output else self.processed_dir
         target_graded = Path(graded_output) if graded_output else self.graded_dir
@@ -151,6 +219,7 @@ class GradeFactoryPipeline:
             output_folder=target_processed,
             name_flag=name_flag,
             xai_api_key=xai_api_key,
+            capture=capture,
         )
 
         grading_result = self.run_grading(
@@ -158,6 +227,7 @@ class GradeFactoryPipeline:
             output_folder=target_graded,
             rubric_path=rubric_path,
             xai_api_key=xai_api_key,
+            capture=capture,
         )
 
         return PipelineResult(processing_result, grading_result)
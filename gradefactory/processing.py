@@ -1,97 +1,406 @@
 import os
-import io
 import re
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 import fitz  # PyMuPDF
-import pypdfium2 as pdfium
-from PIL import Image
 from google.cloud import vision
 import google.generativeai as genai
-import requests
-
-from .prompts import OCR_CORRECTION_PROMPT
-from .utils import save_to_pdf
-
-def get_text_from_image(client, image_content):
-    """Detects text in an image using the Vision API."""
-    image = vision.Image(content=image_content)
-    response = client.document_text_detection(image=image)
-    return response.full_text_annotation.text
-
-def pdf_to_images(pdf_path):
-    """Converts a PDF to a list of PIL images."""
-    doc = pdfium.PdfDocument(pdf_path)
-    for i in range(len(doc)):
-        page = doc.get_page(i)
-        bitmap = page.render(scale=2)  # Increase scale for better quality
-        pil_image = bitmap.to_pil()
-        
-        img_byte_arr = io.BytesIO()
-        pil_image.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        yield img_byte_arr
-
-def fix_ocr_mistakes(text: str, xai_api_key: str) -> str:
+
+from .prompts import OCR_BATCH_CORRECTION_PROMPT, OCR_CORRECTION_PROMPT
+from .utils import content_key, list_pdfs, read_cache_text, save_to_pdf, trim_cache, unique_filename, write_cache_text
+from .xai import chat_completion, make_client, stream_chat_completion
+
+OCR_CONCURRENCY = int(os.getenv("GF_OCR_CONCURRENCY", "10"))
+PDF_CONCURRENCY = int(os.getenv("GF_PDF_CONCURRENCY", "8"))
+# Vision accepts at most 16 images per batch_annotate_images call.
+VISION_BATCH_SIZE = 16
+# Most scans OCR fine at 1.5x; pages Vision finds no text on are re-rendered once at 3x.
+RENDER_SCALE = 1.5
+RETRY_RENDER_SCALE = 3
+# OCR does not need lossless pages; JPEG is far cheaper to encode and upload than PNG.
+JPEG_QUALITY = 85
+
+# Pages of one PDF are corrected in a single Grok request, up to this many at a time.
+CORRECTION_BATCH_SIZE = 8
+_PAGE_DELIMITER_RE = re.compile(r"--- PAGE (\d+) ---[ \t]*")
+
+# Repeat runs reuse OCR and correction results keyed by page content; each cache keeps this many entries.
+OCR_CACHE = "ocr"
+CORRECTION_CACHE = "correct"
+PAGE_CACHE_SIZE = 1000
+
+_NAME_RE = re.compile(r"^name:\s*(.*)", re.IGNORECASE | re.MULTILINE)
+_NAME_CLEAN_TABLE = str.maketrans(' ', '_')
+
+def _get_max_workers():
+    """Number of processes used to render PDF pages (GF_RENDER_WORKERS, default up to 4)."""
+    return int(os.getenv("GF_RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+
+@functools.lru_cache(maxsize=1)
+def _render_pool():
+    """
+    Returns the process-wide render pool, created on first use and reused across runs.
+    Inside a worker process (the web API runs processing in one pool worker per CPU)
+    this returns None and pages render in-process, so render workers do not multiply
+    the process count and each job does not cold-start fresh interpreters.
+    """
+    if multiprocessing.parent_process() is not None:
+        return None
+    # Spawn rather than fork: by then OCR threads and gRPC channels exist. Workers start lazily on first submit.
+    return ProcessPoolExecutor(max_workers=_get_max_workers(), mp_context=multiprocessing.get_context("spawn"))
+
+@functools.lru_cache(maxsize=1)
+def _vision_client():
+    """
+    Returns the process-wide Vision client. Building one loads the credentials and
+    opens a gRPC channel, so it is reused across runs (the web API's worker processes
+    handle many jobs). Failures are not cached, so fixed credentials are picked up.
+    """
+    return vision.ImageAnnotatorClient()
+
+def get_text_from_images(client, images):
+    """
+    Detects text in several images with one Vision request.
+    Returns the texts in input order; an image Vision failed on gets a RuntimeError
+    in its place, so one bad page does not discard the rest of the batch.
+    """
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    annotate_requests = [vision.AnnotateImageRequest(image=vision.Image(content=content), features=[feature]) for content in images]
+    response = client.batch_annotate_images(requests=annotate_requests)
+    texts = []
+    for item in response.responses:
+        if item.error.message:
+            texts.append(RuntimeError(f"Vision OCR failed: {item.error.message}"))
+            continue
+        texts.append(item.full_text_annotation.text)
+    return texts
+
+def _correction_key(raw_text):
+    # Both prompts are part of the key so editing either invalidates old corrections;
+    # most pages are corrected by the batched request, which uses both.
+    return content_key(OCR_CORRECTION_PROMPT, OCR_BATCH_CORRECTION_PROMPT, raw_text)
+
+def _store_cached(namespace, entries):
+    for key, text in entries:
+        write_cache_text(namespace, key, text)
+
+def _render_pages(pdf_path, first, last, scale=RENDER_SCALE):
+    """
+    Renders pages [first, last) of a PDF to JPEG bytes.
+    Runs in render worker processes, so it opens its own document.
+    Each page's pixmap is released before the next page loads, keeping memory flat,
+    and the document is closed even if a page fails to render.
+    """
+    images = []
+    matrix = fitz.Matrix(scale, scale)
+    with fitz.open(pdf_path) as doc:
+        for i in range(first, last):
+            page = doc.load_page(i)
+            pix = page.get_pixmap(matrix=matrix, alpha=False)
+            images.append(pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY))
+            # Drop the native pixmap and page now rather than when the names are rebound.
+            del pix, page
+    return images
+
+def pdf_to_images(pdf_path, executor=None, scale=RENDER_SCALE):
+    """
+    Converts a PDF to a list of JPEG images, one per page, in page order.
+    With an executor, contiguous blocks of pages render in parallel.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+
+    if executor is None or page_count == 0:
+        return _render_pages(pdf_path, 0, page_count, scale)
+
+    # One block per worker keeps per-task overhead (pickling, reopening the PDF) low.
+    block_size = -(-page_count // _get_max_workers())
+    futures = [
+        executor.submit(_render_pages, pdf_path, first, min(first + block_size, page_count), scale)
+        for first in range(0, page_count, block_size)
+    ]
+    return [image for future in futures for image in future.result()]
+
+async def fix_ocr_mistakes(client, text: str, xai_api_key: str) -> str:
     """
     Uses the Grok API to fix OCR mistakes in the given text.
     """
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {xai_api_key}"}
     full_prompt = f"{OCR_CORRECTION_PROMPT}\n\nInput text:\n{text}"
-    data = {"messages": [{"role": "user", "content": full_prompt}], "model": "grok-4-fast-reasoning", "stream": False, "temperature": 0.7}
-    response = requests.post("https://api.x.ai/v1/chat/completions", headers=headers, json=data)
-    response.raise_for_status()
-    return response.json()['choices'][0]['message']['content']
+    return await chat_completion(client, xai_api_key, full_prompt, 0.7)
+
+async def fix_ocr_mistakes_batch(client, pages, xai_api_key, on_page=None):
+    """
+    Fixes OCR mistakes in several pages with one streamed Grok request.
+    on_page(index, text) is called as soon as each page's correction is complete,
+    while later pages are still being generated.
+    Returns the corrected pages in input order; raises ValueError if the reply's page
+    delimiters do not match or the reply was cut off. A page is passed to on_page only once
+    the next delimiter, or a complete reply with every page present, shows it is finished.
+    """
+    if len(pages) == 1:
+        corrected = [await fix_ocr_mistakes(client, pages[0], xai_api_key)]
+        if on_page:
+            on_page(0, corrected[0])
+        return corrected
+
+    labelled = "\n".join(f"--- PAGE {number} ---\n{text}" for number, text in enumerate(pages, start=1))
+    full_prompt = f"{OCR_CORRECTION_PROMPT}\n\n{OCR_BATCH_CORRECTION_PROMPT}\n\nInput text:\n{labelled}"
 
-def run_processing(input_folder: str, output_folder: str, name_flag: bool = True, xai_api_key=None):
+    corrected = []
+    current_lines = None  # None until the first delimiter; text before it is ignored
+
+    def finish_page():
+        text = "\n".join(current_lines).strip("\n")
+        corrected.append(text)
+        if on_page:
+            on_page(len(corrected) - 1, text)
+
+    def handle_line(line):
+        nonlocal current_lines
+        match = _PAGE_DELIMITER_RE.fullmatch(line.rstrip("\r"))
+        if not match:
+            if current_lines is not None:
+                current_lines.append(line)
+            return
+        expected = len(corrected) + (1 if current_lines is None else 2)
+        if int(match.group(1)) != expected or expected > len(pages):
+            raise ValueError(f"Expected page {expected} of {len(pages)} in the correction, got page {match.group(1)}")
+        if current_lines is not None:
+            finish_page()
+        current_lines = []
+
+    partial = ""
+    stream = stream_chat_completion(client, xai_api_key, full_prompt, 0.7)
+    try:
+        async for delta in stream:
+            *lines, partial = (partial + delta).split("\n")
+            for line in lines:
+                handle_line(line)
+    finally:
+        # Closes the HTTP stream promptly if a bad delimiter aborts the read.
+        await stream.aclose()
+    handle_line(partial)
+
+    # A stream cut off after a delimiter looks like a short final page; only accept it
+    # when the reply finished cleanly (checked by stream_chat_completion) and is whole.
+    received = len(corrected) + (current_lines is not None)
+    if received != len(pages):
+        raise ValueError(f"Expected {len(pages)} pages in the correction, got {received}")
+    finish_page()
+    return corrected
+
+async def _save_page(filename, page_number, corrected_text, output_folder, name_flag, claimed_names):
+    """
+    Saves a corrected page, returning the path written (None if saving failed).
+    PDFs are saved concurrently, so a name another page of this run already claimed
+    (e.g. two papers with the same student name) gets a _2, _3, ... suffix.
+    """
+    try:
+        # 4. Determine the output filename
+        output_filename = f"{os.path.splitext(filename)[0]}_page_{page_number}.pdf"
+        if name_flag:
+            match = _NAME_RE.search(corrected_text)
+            if match:
+                student_name = match.group(1).strip().lower().translate(_NAME_CLEAN_TABLE)
+                output_filename = f"{student_name}.pdf"
+
+        output_path = os.path.join(output_folder, unique_filename(output_filename, claimed_names))
+
+        # 5. Save the corrected text to a new PDF
+        await asyncio.to_thread(save_to_pdf, corrected_text, output_path)
+        print(f"  - Successfully saved corrected essay to {output_path}")
+        return output_path
+
+    except Exception as e:
+        print(f"An error occurred while processing page {page_number} of {filename}: {e}")
+        return None
+
+async def _correct_pages(client, semaphore, filename, pages, output_folder, name_flag, claimed_names, xai_api_key):
+    """
+    Corrects a batch of (page_number, raw_text) pages with one Grok request, saving each
+    page as soon as its correction has streamed in.
+    Pages a malformed batched reply did not deliver are retried one request per page.
+    Only corrections from a validated batch or a single-page request are cached.
+    Returns the paths written; errors are reported and do not stop sibling batches.
+    """
+    page_list = ", ".join(str(page_number) for page_number, _ in pages)
+    raw_texts = [raw_text for _, raw_text in pages]
+    saves = {}
+    fresh = []
+
+    def save(index, corrected_text):
+        saves[index] = asyncio.create_task(_save_page(filename, pages[index][0], corrected_text, output_folder, name_flag, claimed_names))
+
+    async with semaphore:
+        try:
+            # 3. Correct the OCR text
+            print(f"  - Correcting OCR mistakes on page(s) {page_list} of {filename} with AI...")
+            try:
+                corrected = await fix_ocr_mistakes_batch(client, raw_texts, xai_api_key, on_page=save)
+                fresh.extend((_correction_key(raw_text), corrected_text) for raw_text, corrected_text in zip(raw_texts, corrected))
+            except ValueError as e:
+                remaining = [index for index in range(len(pages)) if index not in saves]
+                print(f"  - Warning: {e}; correcting the remaining page(s) of {filename} one at a time.")
+                corrected = await asyncio.gather(*(fix_ocr_mistakes(client, raw_texts[index], xai_api_key) for index in remaining))
+                for index, corrected_text in zip(remaining, corrected):
+                    save(index, corrected_text)
+                    fresh.append((_correction_key(raw_texts[index]), corrected_text))
+        except Exception as e:
+            missing = ", ".join(str(page_number) for index, (page_number, _) in enumerate(pages) if index not in saves)
+            print(f"An error occurred while processing page(s) {missing} of {filename}: {e}")
+
+    await asyncio.to_thread(_store_cached, CORRECTION_CACHE, fresh)
+    output_paths = await asyncio.gather(*(saves[index] for index in sorted(saves)))
+    return [path for path in output_paths if path]
+
+def _lookup_cached(namespace, keys):
+    return [read_cache_text(namespace, key) for key in keys]
+
+async def _ocr_pages(vision_client, filename, images):
+    """
+    OCRs rendered pages in Vision batches, reusing cached text for pages seen on earlier runs.
+    Pages OCR failed on are reported and come back as None; the other pages are unaffected.
+    """
+    ocr_keys = [content_key(image_bytes) for image_bytes in images]
+    raw_texts = await asyncio.to_thread(_lookup_cached, OCR_CACHE, ocr_keys)
+    missing = [i for i, raw_text in enumerate(raw_texts) if raw_text is None]
+    if missing:
+        print(f"  - Running OCR on {len(missing)} page(s) of {filename}...")
+
+        async def ocr_batch(indices):
+            try:
+                return await asyncio.to_thread(get_text_from_images, vision_client, [images[i] for i in indices])
+            except Exception as e:
+                return [e] * len(indices)
+
+        batches = await asyncio.gather(*(
+            ocr_batch(missing[start:start + VISION_BATCH_SIZE])
+            for start in range(0, len(missing), VISION_BATCH_SIZE)
+        ))
+        for i, result in zip(missing, (text for batch in batches for text in batch)):
+            if isinstance(result, Exception):
+                print(f"  - Warning: OCR failed on page {i+1} of {filename}: {result}")
+                continue
+            raw_texts[i] = result
+        await asyncio.to_thread(_store_cached, OCR_CACHE, [(ocr_keys[i], raw_texts[i]) for i in missing if raw_texts[i] is not None])
+    return raw_texts
+
+async def _ocr_and_correct(client, vision_client, render_pool, semaphore, filename, input_path, images, output_folder, name_flag, claimed_names, xai_api_key):
+    """
+    OCRs a rendered PDF in Vision batches, retrying blank pages once at a higher
+    resolution, then corrects its pages in concurrent batches of up to
+    CORRECTION_BATCH_SIZE. Pages seen on earlier runs reuse their cached OCR text
+    and correction. Returns the paths written.
+    """
+    try:
+        # 2. OCR the pages, up to VISION_BATCH_SIZE per request
+        raw_texts = await _ocr_pages(vision_client, filename, images)
+    except Exception as e:
+        print(f"An error occurred while processing {filename}: {e}")
+        return []
+
+    blank = [i for i, raw_text in enumerate(raw_texts) if raw_text is not None and not raw_text.strip()]
+    if blank:
+        print(f"  - No text found on {len(blank)} page(s) of {filename}; retrying at higher resolution...")
+        loop = asyncio.get_running_loop()
+        try:
+            rerendered = await asyncio.gather(*(
+                loop.run_in_executor(render_pool, _render_pages, input_path, i, i + 1, RETRY_RENDER_SCALE)
+                for i in blank
+            ))
+            retried = await _ocr_pages(vision_client, filename, [images[0] for images in rerendered])
+            for i, raw_text in zip(blank, retried):
+                if raw_text is not None:
+                    raw_texts[i] = raw_text
+        except Exception as e:
+            print(f"  - Warning: High-resolution retry failed for {filename}: {e}")
+
+    pages = []
+    for i, raw_text in enumerate(raw_texts):
+        if raw_text is None:
+            # Already reported by _ocr_pages.
+            continue
+        if not raw_text.strip():
+            print(f"  - Warning: No text found on page {i+1} of {filename}. Skipping.")
+            continue
+        pages.append((i + 1, raw_text))
+
+    cached = await asyncio.to_thread(_lookup_cached, CORRECTION_CACHE, [_correction_key(raw_text) for _, raw_text in pages])
+    reused = [
+        _save_page(filename, page_number, corrected_text, output_folder, name_flag, claimed_names)
+        for (page_number, _), corrected_text in zip(pages, cached)
+        if corrected_text is not None
+    ]
+    if reused:
+        print(f"  - Reusing cached corrections for {len(reused)} page(s) of {filename}.")
+    pages = [page for page, corrected_text in zip(pages, cached) if corrected_text is None]
+
+    reused_paths, corrected_paths = await asyncio.gather(
+        asyncio.gather(*reused),
+        asyncio.gather(*(
+            _correct_pages(client, semaphore, filename, pages[start:start + CORRECTION_BATCH_SIZE], output_folder, name_flag, claimed_names, xai_api_key)
+            for start in range(0, len(pages), CORRECTION_BATCH_SIZE)
+        )),
+    )
+    return [path for path in reused_paths if path] + [path for paths in corrected_paths for path in paths]
+
+async def _process_pdfs(output_folder, pdf_files, vision_client, render_pool, name_flag, xai_api_key):
+    """
+    Processes up to PDF_CONCURRENCY PDFs at once. Within that, render -> OCR -> correction
+    overlap across PDFs: while one waits on Vision or Grok, another is rendering, and the
+    number of PDFs in flight bounds the rendered pages held in memory.
+    At most OCR_CONCURRENCY correction requests are in flight at once.
+    Returns the paths written.
+    """
+    semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+    in_flight = asyncio.Semaphore(PDF_CONCURRENCY)
+    claimed_names = set()
+
+    async def process_one(filename, input_path):
+        async with in_flight:
+            print(f"\nProcessing: {input_path}")
+
+            try:
+                # 1. Convert each page of the PDF to an image
+                images = await asyncio.to_thread(pdf_to_images, input_path, render_pool)
+            except Exception as e:
+                print(f"An error occurred while processing {filename}: {e}")
+                return []
+
+            return await _ocr_and_correct(
+                client, vision_client, render_pool, semaphore, filename, input_path, images, output_folder, name_flag, claimed_names, xai_api_key
+            )
+
+    async with make_client(max(32, OCR_CONCURRENCY * 2)) as client:
+        written = await asyncio.gather(*(process_one(filename, input_path) for filename, input_path in pdf_files))
+    return [path for paths in written for path in paths]
+
+def run_processing(input_folder: Path, output_folder: Path, name_flag: bool = True, xai_api_key=None):
     """
     Processes all PDFs in the input folder, performs OCR, corrects the text,
-    and saves them to the output folder.
+    and saves them to the output folder. Folders may be str or Path.
+    Returns the sorted paths of the PDFs written.
     """
     print("--- Starting OCR and Text Correction Process ---")
 
     # Set up the Vision API client
     try:
-        client = vision.ImageAnnotatorClient()
+        client = _vision_client()
     except Exception as e:
         raise RuntimeError(f"Failed to create Google Cloud Vision client. Check credentials. Error: {e}")
 
     if not os.path.isdir(output_folder):
         os.makedirs(output_folder)
 
-    pdf_files = [f for f in os.listdir(input_folder) if f.lower().endswith(".pdf")]
-
-    for filename in pdf_files:
-        input_path = os.path.join(input_folder, filename)
-        print(f"\nProcessing: {input_path}")
+    pdf_files = list_pdfs(input_folder)
 
-        try:
-            # 1. Convert each page of the PDF to an image and get OCR text
-            for i, image_bytes in enumerate(pdf_to_images(input_path)):
-                print(f"  - Processing page {i+1}...")
-                raw_text = get_text_from_image(client, image_bytes)
-
-                if not raw_text.strip():
-                    print(f"  - Warning: No text found on page {i+1} of {filename}. Skipping.")
-                    continue
-
-                # 2. Correct the OCR text
-                print("  - Correcting OCR mistakes with AI...")
-                corrected_text = fix_ocr_mistakes(raw_text, xai_api_key)
-
-                # 3. Determine the output filename
-                output_filename = f"{os.path.splitext(filename)[0]}_page_{i+1}.pdf"
-                if name_flag:
-                    match = re.search(r"^name:\s*(.*)", corrected_text, re.IGNORECASE | re.MULTILINE)
-                    if match:
-                        student_name = match.group(1).strip().lower().replace(' ', '_')
-                        output_filename = f"{student_name}.pdf"
-                
-                output_path = os.path.join(output_folder, output_filename)
-
-                # 4. Save the corrected text to a new PDF
-                save_to_pdf(corrected_text, output_path)
-                print(f"  - Successfully saved corrected essay to {output_path}")
+    written = asyncio.run(_process_pdfs(output_folder, pdf_files, client, _render_pool(), name_flag, xai_api_key))
 
-        except Exception as e:
-            print(f"An error occurred while processing {filename}: {e}")
+    trim_cache(OCR_CACHE, PAGE_CACHE_SIZE)
+    trim_cache(CORRECTION_CACHE, PAGE_CACHE_SIZE)
 
     print("\n--- OCR and Text Correction Process Complete ---")
+    return sorted(written)
@@ -3,3 +3,5 @@ GRADING_PROMPT = """You are a fair and encouraging grader for instructor-assigne
 MODERATOR_PROMPT = """You are a moderator for essay grades in this course. Review the scores and feedback from two general grading agents. Independently read and evaluate the essay using the same rubric to decide which agent's set of scores best aligns with your assessment—pick one agent's full set of criterion scores as the final, explaining briefly why (e.g., 'Agent 1's scores better capture the essay's foundational strengths'). If neither fully aligns, you may adjust by the smallest increment allowed in the rubric, but prioritize selecting one agent's scores. Ensure the final feedback is balanced and encouraging, adhering strictly to the rubric guidelines for this assignment (lean toward the rubric's mid-range for average papers). Provide the final scores with explanations, and include the total using the rubric's actual maximum. Conclude with a "Score Summary" section that lists each rubric criterion exactly as named in the rubric, each on its own line formatted as "Criterion Name: earned/max" using the rubric's point scale. End the summary with "Total: earned_total/max_total" on its own line and add no further commentary after this section. Rubric: [Insert full rubric JSON here]."""
 
 OCR_CORRECTION_PROMPT = """You are an AI agent tasked with correcting errors in OCR-generated text. Your goal is to analyze the input text, identify OCR mistakes (such as misread characters, misspelled words, or incorrect punctuation), and produce a corrected version of the text. Preserve the original format, structure, and intent of the text exactly as provided, including line breaks, spacing, and capitalization. Do not add any comments, explanations, or additional content beyond the corrected text. Only output the corrected version of the input text."""
+
+OCR_BATCH_CORRECTION_PROMPT = """The input text contains several independent pages. Each page begins with a delimiter line of the form "--- PAGE k ---". Correct each page separately, following the instructions above. Output every page in the original order, each preceded by its delimiter line copied exactly. Do not merge, drop, or renumber pages, and do not output anything outside the delimited pages."""
@@ -3,6 +3,7 @@ const jobDetailPanel = document.getElementById('job-detail-panel');
 const jobDetailTarget = document.getElementById('job-detail');
 const closeDetailButton = document.getElementById('close-detail');
 const refreshJobsButton = document.getElementById('refresh-jobs');
+let detailStream = null;
 
 let pinValue = localStorage.getItem('gradefactoryPin');
 if (pinValue === null || pinValue === '') {
@@ -194,11 +195,63 @@ async function showJobDetail(jobId) {
     }
     const job = await response.json();
     renderJobDetail(job);
+    if (job.status === 'pending' || job.status === 'running') {
+      followJob(job.id);
+    }
   } catch (error) {
     alert(error.message);
   }
 }
 
+function stopFollowingJob() {
+  if (detailStream) {
+    detailStream.abort();
+    detailStream = null;
+  }
+}
+
+async function followJob(jobId) {
+  // EventSource cannot send the PIN header, so the event stream is read through fetch.
+  stopFollowingJob();
+  const controller = new AbortController();
+  detailStream = controller;
+  try {
+    const response = await fetchWithPin(withBase(`/jobs/${jobId}/stream`), { signal: controller.signal });
+    if (!response.ok) {
+      return;
+    }
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) {
+        break;
+      }
+      buffer += value;
+      const events = buffer.split('\n\n');
+      buffer = events.pop();
+      for (const event of events) {
+        if (!event.startsWith('data: ')) {
+          continue;
+        }
+        const job = JSON.parse(event.slice('data: '.length));
+        if (jobDetailTarget.dataset.jobId === job.id) {
+          renderJobDetail(job);
+        }
+      }
+    }
+    await loadJobs();
+  } catch (error) {
+    if (error.name !== 'AbortError') {
+      console.warn(`Stopped following job ${jobId}: ${error.message}`);
+    }
+  } finally {
+    if (detailStream === controller) {
+      detailStream = null;
+    }
+  }
+}
+
 function renderJobDetail(job) {
   jobDetailTarget.dataset.jobId = job.id;
   jobDetailTarget.innerHTML = '';
@@ -255,6 +308,7 @@ async function deleteJob(jobId) {
       throw new Error(reason);
     }
     if (jobDetailTarget.dataset.jobId && jobDetailTarget.dataset.jobId === jobId) {
+      stopFollowingJob();
       jobDetailTarget.dataset.jobId = '';
       jobDetailPanel.hidden = true;
       jobDetailTarget.innerHTML = '';
@@ -266,6 +320,7 @@ async function deleteJob(jobId) {
 }
 
 closeDetailButton.addEventListener('click', () => {
+  stopFollowingJob();
   jobDetailTarget.dataset.jobId = '';
   jobDetailPanel.hidden = true;
   jobDetailTarget.innerHTML = '';
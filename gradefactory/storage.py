@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import re
+import secrets
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+_KEY_PATTERN = re.compile(r"^[0-9a-f]{32}/[^/\\]+$")
+
+
+class InvalidUploadToken(ValueError):
+    """Raised when an upload URL is malformed, tampered with, or expired."""
+
+
+class LocalSignedStore:
+    """Stages client uploads on local disk behind HMAC-signed, one-shot PUT URLs."""
+
+    def __init__(self, root: Path, secret: Optional[bytes] = None, ttl_seconds: int = 900) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self._secret = secret or secrets.token_bytes(32)
+
+    def presign(self, filename: str) -> Tuple[str, str, int]:
+        """Returns (key, token, expires_at) for a new upload slot."""
+        self.purge_stale()
+        safe_name = Path(filename or "upload.pdf").name
+        key = f"{uuid.uuid4().hex}/{safe_name}"
+        expires_at = int(time.time()) + self.ttl_seconds
+        payload = f"{expires_at}:{key}".encode("utf-8")
+        encoded = base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+        return key, f"{encoded}.{self._sign(payload)}", expires_at
+
+    def verify(self, token: str) -> str:
+        """Checks a token's signature and expiry and returns the key it grants."""
+        encoded, _, signature = token.partition(".")
+        try:
+            payload = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+            expires_text, _, key = payload.decode("utf-8").partition(":")
+            expires_at = int(expires_text)
+        except ValueError:
+            raise InvalidUploadToken("Malformed upload token.") from None
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            raise InvalidUploadToken("Invalid upload token signature.")
+        if expires_at < time.time():
+            raise InvalidUploadToken("Upload URL has expired.")
+        return key
+
+    def staged_path(self, key: str) -> Path:
+        """Maps a key to its staging location, rejecting anything that could escape the root."""
+        if not _KEY_PATTERN.match(key) or key.endswith(("/.", "/..")):
+            raise InvalidUploadToken(f"Invalid upload key: {key}")
+        return self.root / key
+
+    def take(self, key: str, destination: Path, name: Optional[str] = None) -> Path:
+        """Moves a completed upload into a job folder, as name if given, and frees its slot."""
+        source = self.staged_path(key)
+        if not source.is_file():
+            raise FileNotFoundError(f"No completed upload for key: {key}")
+        destination.mkdir(parents=True, exist_ok=True)
+        target = destination / (name or source.name)
+        shutil.move(str(source), str(target))
+        shutil.rmtree(source.parent, ignore_errors=True)
+        return target
+
+    def purge_stale(self) -> None:
+        """Removes staged uploads that were never claimed by a job."""
+        cutoff = time.time() - 2 * self.ttl_seconds
+        for slot in self.root.iterdir():
+            try:
+                if slot.is_dir() and slot.stat().st_mtime < cutoff:
+                    shutil.rmtree(slot, ignore_errors=True)
+            except OSError:
+                continue
+
+    def _sign(self, payload: bytes) -> str:
+        return hmac.new(self._secret, payload, hashlib.sha256).hexdigest()
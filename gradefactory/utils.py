@@ -1,9 +1,26 @@
 import os
 import json
+import hashlib
+import functools
+import threading
+from pathlib import Path
+from types import MappingProxyType
 import fitz  # PyMuPDF
 from dotenv import load_dotenv
 from fpdf import FPDF
 
+CACHE_DIR = Path(os.getenv("GF_CACHE_DIR", Path.home() / ".cache" / "gradefactory"))
+# Cache namespaces for extracted paper text and parsed rubrics; trimmed after each grading run.
+TEXT_CACHE = "text"
+RUBRIC_CACHE = "rubric"
+TEXT_CACHE_SIZE = 1000
+RUBRIC_CACHE_SIZE = 100
+_DEJAVU_FONT_PATHS = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/DejaVuSans.ttf",
+)
+
 def load_api_keys():
     """
     Loads API keys from .env file and configures Google Cloud credentials.
@@ -70,25 +87,195 @@ def get_rubric_data(rubric_path):
     Returns a dict with 'rubric', 'question', 'correct_answers'.
     PDF rubrics only have rubric text, others empty.
     """
-    if rubric_path.lower().endswith('.pdf'):
+    suffix = str(rubric_path).lower()
+    if suffix.endswith('.pdf'):
         rubric_text = extract_text_from_pdf(rubric_path)
         return {
             'rubric': rubric_text,
             'question': '',
             'correct_answers': []
         }
-    elif rubric_path.lower().endswith('.json'):
+    elif suffix.endswith('.json'):
         return extract_data_from_json(rubric_path)
     else:
         raise ValueError("Unsupported rubric file format. Please use a .pdf or .json file.")
 
+def list_pdfs(folder):
+    """
+    Returns (name, path) pairs for the PDFs in a folder, sorted by name.
+    Hidden files and symlinks are skipped.
+    """
+    with os.scandir(folder) as entries:
+        pdfs = [
+            (entry.name, entry.path)
+            for entry in entries
+            if not entry.name.startswith('.')
+            and entry.name.lower().endswith('.pdf')
+            and entry.is_file(follow_symlinks=False)
+        ]
+    pdfs.sort()
+    return pdfs
+
+def unique_filename(name, taken):
+    """
+    Returns name, or name with a _2, _3, ... suffix if it is already in taken (compared
+    case-insensitively), and records the result in taken.
+    """
+    stem, suffix = os.path.splitext(name)
+    candidate = name
+    counter = 2
+    while candidate.lower() in taken:
+        candidate = f"{stem}_{counter}{suffix}"
+        counter += 1
+    taken.add(candidate.lower())
+    return candidate
+
+def file_digest(path):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_cache_file(cache_path, text):
+    """
+    Atomically writes a cache entry. Cache failures are never fatal.
+    """
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_text(text, encoding='utf-8')
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+
+def content_key(*parts):
+    """
+    Returns a short BLAKE2b hex key for cache lookups. str parts are UTF-8 encoded.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode('utf-8') if isinstance(part, str) else part)
+    return digest.hexdigest()
+
+def read_cache_text(namespace, key):
+    """
+    Returns a cached text entry from CACHE_DIR/<namespace>, or None on a miss.
+    Hits are touched so trim_cache evicts the least recently used entries.
+    """
+    cache_path = CACHE_DIR / namespace / f"{key}.txt"
+    try:
+        text = cache_path.read_text(encoding='utf-8')
+        os.utime(cache_path)
+        return text
+    except (OSError, UnicodeDecodeError):
+        return None
+
+def write_cache_text(namespace, key, text):
+    """
+    Atomically stores a text entry in CACHE_DIR/<namespace>; safe with concurrent workers.
+    """
+    _write_cache_file(CACHE_DIR / namespace / f"{key}.txt", text)
+
+def trim_cache(namespace, max_entries=1000):
+    """
+    Deletes the least recently used entries in CACHE_DIR/<namespace> beyond max_entries.
+    """
+    try:
+        with os.scandir(CACHE_DIR / namespace) as it:
+            entries = [(entry.stat().st_mtime, entry.path) for entry in it if entry.name.endswith('.txt')]
+    except OSError:
+        return
+    if len(entries) <= max_entries:
+        return
+    entries.sort()
+    for _, path in entries[:len(entries) - max_entries]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def cached_extract_text(pdf_path, digest=None):
+    """
+    Extracts text from a PDF, reusing a cached copy keyed by the file's SHA-256.
+    Pass digest when the caller has already hashed the file.
+    """
+    key = digest or file_digest(pdf_path)
+    text = read_cache_text(TEXT_CACHE, key)
+    if text is not None:
+        return text
+    text = extract_text_from_pdf(pdf_path)
+    write_cache_text(TEXT_CACHE, key, text)
+    return text
+
+def _freeze_rubric_data(rubric_data):
+    """
+    Returns a read-only view of parsed rubric data, so cached parses cannot be mutated by callers.
+    """
+    return MappingProxyType({
+        'rubric': rubric_data['rubric'],
+        'question': rubric_data['question'],
+        'correct_answers': tuple(rubric_data['correct_answers']),
+    })
+
+@functools.lru_cache(maxsize=32)
+def _memoized_rubric_data(rubric_path, mtime_ns, size):
+    """
+    In-process memo keyed by the file's path and stat, so repeat calls skip hashing the file.
+    """
+    return _load_rubric_data(rubric_path, file_digest(rubric_path))
+
+def _load_rubric_data(rubric_path, digest):
+    cached = read_cache_text(RUBRIC_CACHE, digest)
+    if cached is not None:
+        try:
+            return _freeze_rubric_data(json.loads(cached))
+        except (ValueError, KeyError):
+            pass
+    rubric_data = get_rubric_data(rubric_path)
+    write_cache_text(RUBRIC_CACHE, digest, json.dumps(rubric_data))
+    return _freeze_rubric_data(rubric_data)
+
+def cached_rubric_data(rubric_path, digest=None):
+    """
+    Same as get_rubric_data, but reuses a cached parse keyed by the file's SHA-256
+    and returns it as a read-only mapping.
+    Pass digest when the caller has already hashed the file; otherwise parses are
+    also memoized in-process until the file's mtime or size changes.
+    """
+    if digest:
+        return _load_rubric_data(rubric_path, digest)
+    stat = os.stat(rubric_path)
+    return _memoized_rubric_data(str(rubric_path), stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize=1)
+def _unicode_font_path():
+    """
+    Returns a Unicode TTF font for generated PDFs: GF_PDF_FONT if set, else DejaVu Sans when installed.
+    """
+    candidates = [os.getenv("GF_PDF_FONT"), *_DEJAVU_FONT_PATHS]
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate):
+            return candidate
+    return None
+
 def save_to_pdf(text, output_path):
     """
     Saves the given text to a PDF file.
+    Text is written as-is with a Unicode TTF font; without one, the core Arial font
+    only covers latin-1 and other characters are replaced.
     """
     pdf = FPDF()
     pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    # Encode with latin-1 to handle potential unicode errors, replacing unknown chars
-    pdf.multi_cell(0, 10, text.encode('latin-1', 'replace').decode('latin-1'))
+    font_path = _unicode_font_path()
+    if font_path:
+        pdf.add_font("GradeFactory", fname=font_path)
+        pdf.set_font("GradeFactory", size=12)
+    else:
+        pdf.set_font("Arial", size=12)
+        text = text.encode('latin-1', 'replace').decode('latin-1')
+    pdf.multi_cell(0, 10, text)
     pdf.output(output_path)
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import httpx
+
+XAI_CHAT_URL = "https://api.x.ai/v1/chat/completions"
+XAI_MODEL = "grok-4-fast-reasoning"
+XAI_TIMEOUT = httpx.Timeout(120.0, connect=5.0)
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+_MAX_RETRIES = 3
+KEEPALIVE_EXPIRY = 60.0
+
+def make_client(max_connections=64):
+    """
+    Builds an HTTP/2 client for Grok calls.
+    The client is bound to the event loop that uses it, so create one per asyncio.run.
+    """
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=_MAX_RETRIES,
+        # Pages spend seconds in render and OCR between Grok calls; keep idle sockets
+        # well past httpx's 5s default so they are reused instead of re-handshaking.
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+    )
+    return httpx.AsyncClient(transport=transport, timeout=XAI_TIMEOUT)
+
+async def chat_completion(client, api_key, prompt, temperature):
+    """
+    Sends a single-message chat completion to Grok, retrying rate limits and server errors.
+    """
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+    data = {"messages": [{"role": "user", "content": prompt}], "model": XAI_MODEL, "stream": False, "temperature": temperature}
+    for attempt in range(_MAX_RETRIES + 1):
+        response = await client.post(XAI_CHAT_URL, headers=headers, json=data)
+        if response.status_code in _RETRY_STATUSES and attempt < _MAX_RETRIES:
+            await asyncio.sleep(0.5 * 2 ** attempt)
+            continue
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+
+class IncompleteCompletion(ValueError):
+    """Raised when a streamed completion ends before the model finished its reply."""
+
+async def stream_chat_completion(client, api_key, prompt, temperature):
+    """
+    Streams a single-message chat completion from Grok, yielding content deltas as they are generated.
+    Rate limits and server errors are retried like chat_completion, before any content arrives.
+    Raises IncompleteCompletion after the last delta if the stream ended without [DONE] or the
+    model stopped for any reason other than 'stop' (e.g. the token limit).
+    """
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+    data = {"messages": [{"role": "user", "content": prompt}], "model": XAI_MODEL, "stream": True, "temperature": temperature}
+    for attempt in range(_MAX_RETRIES + 1):
+        async with client.stream("POST", XAI_CHAT_URL, headers=headers, json=data) as response:
+            if response.status_code in _RETRY_STATUSES and attempt < _MAX_RETRIES:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+                continue
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            finish_reason = None
+            done = False
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    done = True
+                    break
+                choice = json.loads(payload)['choices'][0]
+                finish_reason = choice.get('finish_reason') or finish_reason
+                delta = choice.get('delta', {}).get('content')
+                if delta:
+                    yield delta
+            if finish_reason != "stop" and not (done and finish_reason is None):
+                raise IncompleteCompletion(f"Completion stream ended early (finish_reason={finish_reason})")
+            return
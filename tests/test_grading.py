@@ -0,0 +1,13 @@
+from gradefactory.grading import parse_score_summary
+
+
+def test_total_label_with_space_before_colon_is_not_a_criterion():
+    criteria, total = parse_score_summary("Thesis: 4/5\nEvidence: 3/5\nTotal : 7/10")
+    assert list(criteria) == ["Thesis", "Evidence"]
+    assert total == (7.0, 10.0)
+
+
+def test_total_falls_back_to_criterion_sum():
+    criteria, total = parse_score_summary("Thesis: 4/5\nEvidence: 3/5")
+    assert criteria == {"Thesis": (4.0, 5.0), "Evidence": (3.0, 5.0)}
+    assert total == (7.0, 10.0)
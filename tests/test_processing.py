@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from gradefactory import processing
+from gradefactory.xai import IncompleteCompletion
+
+
+def _stub_stream(monkeypatch, chunks):
+    async def stream(client, api_key, prompt, temperature):
+        for chunk in chunks:
+            yield chunk
+
+    monkeypatch.setattr(processing, "stream_chat_completion", stream)
+
+
+def _correct(pages):
+    delivered = []
+    result = asyncio.run(
+        processing.fix_ocr_mistakes_batch(None, pages, "key", on_page=lambda index, text: delivered.append((index, text)))
+    )
+    return result, delivered
+
+
+def test_in_order_reply_is_split_per_page(monkeypatch):
+    # Delimiters split across stream chunks must still be recognised.
+    _stub_stream(monkeypatch, ["--- PAGE 1 ---\nfirst\n--- PA", "GE 2 ---\nsecond\nline\n--- PAGE 3 ---\nthird"])
+    result, delivered = _correct(["a", "b", "c"])
+    assert result == ["first", "second\nline", "third"]
+    assert delivered == [(0, "first"), (1, "second\nline"), (2, "third")]
+
+
+def test_preamble_before_first_delimiter_is_ignored(monkeypatch):
+    _stub_stream(monkeypatch, ["Here are the corrected pages:\n\n--- PAGE 1 ---\nfirst\n--- PAGE 2 ---\nsecond\n"])
+    result, _ = _correct(["a", "b"])
+    assert result == ["first", "second"]
+
+
+def test_out_of_order_reply_raises_and_leaves_the_open_page_for_retry(monkeypatch):
+    # Page 2 is not confirmed by a valid next delimiter, so only page 1 is delivered.
+    _stub_stream(monkeypatch, ["--- PAGE 1 ---\nfirst\n--- PAGE 2 ---\nsecond\n--- PAGE 4 ---\nfourth\n"])
+    delivered = []
+    with pytest.raises(ValueError, match="Expected page 3"):
+        asyncio.run(processing.fix_ocr_mistakes_batch(None, ["a", "b", "c", "d"], "key", on_page=lambda i, t: delivered.append(i)))
+    assert delivered == [0]
+
+
+def test_short_reply_does_not_deliver_its_last_page(monkeypatch):
+    _stub_stream(monkeypatch, ["--- PAGE 1 ---\nhello\n--- PAGE 2 ---\n"])
+    delivered = []
+    with pytest.raises(ValueError, match="got 2"):
+        asyncio.run(processing.fix_ocr_mistakes_batch(None, ["a", "b", "c"], "key", on_page=lambda i, t: delivered.append((i, t))))
+    assert delivered == [(0, "hello")]
+
+
+def test_reply_cut_off_by_the_stream_does_not_deliver_its_last_page(monkeypatch):
+    async def stream(client, api_key, prompt, temperature):
+        yield "--- PAGE 1 ---\nfirst\n--- PAGE 2 ---\nsec"
+        raise IncompleteCompletion("Completion stream ended early (finish_reason=length)")
+
+    monkeypatch.setattr(processing, "stream_chat_completion", stream)
+    delivered = []
+    with pytest.raises(ValueError):
+        asyncio.run(processing.fix_ocr_mistakes_batch(None, ["a", "b"], "key", on_page=lambda i, t: delivered.append(i)))
+    assert delivered == [0]
+
+
+def test_single_page_uses_a_plain_request(monkeypatch):
+    async def fix(client, text, api_key):
+        return f"fixed {text}"
+
+    monkeypatch.setattr(processing, "fix_ocr_mistakes", fix)
+    result, delivered = _correct(["a"])
+    assert result == ["fixed a"]
+    assert delivered == [(0, "fixed a")]
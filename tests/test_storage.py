@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from gradefactory.storage import InvalidUploadToken, LocalSignedStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalSignedStore(tmp_path / "uploads", secret=b"secret", ttl_seconds=60)
+
+
+def test_presigned_token_grants_its_key(store):
+    key, token, _ = store.presign("essay.pdf")
+    assert store.verify(token) == key
+    assert store.staged_path(key) == store.root / key
+
+
+def test_tampered_token_is_rejected(store):
+    _, token, _ = store.presign("essay.pdf")
+    encoded, _, signature = token.partition(".")
+    forged = ("0" if signature[0] != "0" else "1") + signature[1:]
+    with pytest.raises(InvalidUploadToken, match="signature"):
+        store.verify(f"{encoded}.{forged}")
+    with pytest.raises(InvalidUploadToken):
+        store.verify("not-a-token")
+
+
+def test_token_from_another_secret_is_rejected(store, tmp_path):
+    other = LocalSignedStore(tmp_path / "other", secret=b"other-secret")
+    _, token, _ = other.presign("essay.pdf")
+    with pytest.raises(InvalidUploadToken, match="signature"):
+        store.verify(token)
+
+
+def test_expired_token_is_rejected(store, monkeypatch):
+    _, token, expires_at = store.presign("essay.pdf")
+    monkeypatch.setattr(time, "time", lambda: expires_at + 1)
+    with pytest.raises(InvalidUploadToken, match="expired"):
+        store.verify(token)
+
+
+@pytest.mark.parametrize(
+    "key",
+    [
+        "../essay.pdf",
+        "0123456789abcdef0123456789abcdef/../../essay.pdf",
+        "0123456789abcdef0123456789abcdef/..",
+        "0123456789abcdef0123456789abcdef/.",
+        "0123456789abcdef0123456789abcdef/sub/essay.pdf",
+        "0123456789abcdef0123456789abcdef/..\\essay.pdf",
+        "/etc/passwd",
+        "not-hex/essay.pdf",
+    ],
+)
+def test_keys_that_could_escape_the_root_are_rejected(store, key):
+    with pytest.raises(InvalidUploadToken):
+        store.staged_path(key)
+
+
+def test_take_moves_the_upload_and_frees_its_slot(store, tmp_path):
+    key, _, _ = store.presign("essay.pdf")
+    staged = store.staged_path(key)
+    staged.parent.mkdir(parents=True)
+    staged.write_bytes(b"%PDF")
+    target = store.take(key, tmp_path / "job", "essay_2.pdf")
+    assert target == tmp_path / "job" / "essay_2.pdf"
+    assert target.read_bytes() == b"%PDF"
+    assert not staged.parent.exists()
+    with pytest.raises(FileNotFoundError):
+        store.take(key, tmp_path / "job")